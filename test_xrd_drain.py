@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+# vim: set fileencoding=utf-8 :
+'''
+Tests of xrd_drain.py, batches are migrated by a local move into temporary directories
+'''
+import sys
+from grp import getgrgid
+from importlib.util import module_from_spec, spec_from_file_location
+from multiprocessing import Lock
+from os import getgid, getuid, makedirs, path, readlink, symlink
+from pwd import getpwuid
+from tempfile import TemporaryDirectory
+from unittest import TestCase, main
+
+from xrd_control import AIMDController, RateLimiter
+from xrd_journal import DrainJournal, load_journal
+from xrd_metrics import DrainMetrics
+from xrd_remote import LocalHelper
+
+DRAIN: str = path.join(path.dirname(path.abspath(__file__)), 'xrd_drain.py')
+
+
+def load_drain(arguments: list) -> object:
+    '''
+    Imports xrd_drain.py configured by command line arguments
+    '''
+    saved_argv: list = sys.argv
+    sys.argv = [DRAIN] + arguments
+    try:
+        spec: object = spec_from_file_location('xrd_drain_under_test', DRAIN)
+        drain: object = module_from_spec(spec)
+        spec.loader.exec_module(drain)
+    finally:
+        sys.argv = saved_argv
+    return drain
+
+
+class MigrateTest(TestCase):
+    '''
+    migrate() of one batch
+    '''
+    def test_duplicate_links_in_one_batch(self) -> None:
+        '''
+        The first link of a data file migrates it,
+        the other links to it are reported and journaled as failed, none is dropped
+        '''
+        with TemporaryDirectory() as root:
+            name_space, data, new_name_space, new_data = (path.join(root, directory) \
+                for directory in ('ns', 'data', 'dns', 'ddata'))
+            for directory in (name_space, data, new_name_space, new_data):
+                makedirs(path.join(directory, '00'))
+            batch: list = []
+            for name in ('a', 'b'):
+                with open(path.join(data, '00', name), 'w', encoding='utf-8') as data_handle:
+                    data_handle.write(name)
+            for number, (link, target) in enumerate([('a', 'a'), ('dup1', 'a'), ('b', 'b'), \
+                ('dup2', 'a')]):
+                symlink(path.join(data, '00', target), path.join(name_space, '00', link))
+                batch.append((path.join(name_space, '00', link), path.join(data, '00', target), \
+                    number, 1))
+            owner: str = f'{getpwuid(getuid()).pw_name}:{getgrgid(getgid()).gr_name}'
+            drain: object = load_drain(['--quiet', name_space, data, 'localhost', \
+                new_name_space, new_data, owner, '1'])
+            journal_file: str = path.join(root, 'journal')
+            journal: DrainJournal = DrainJournal(journal_file, True)
+            worker: dict = {
+                'id': '0001',
+                'destination': drain.DESTINATIONS[0],
+                'iolock': Lock(),
+                'helper': LocalHelper(),
+                'journal': journal,
+                'controller': AIMDController(1, initial=1),
+                'limiter': RateLimiter(),
+                'metrics': DrainMetrics(),
+            }
+            # Past the start up delay of the first transfers
+            drain.migrate(batch, 1_000, worker)
+            journal.close()
+            done, failed = load_journal(journal_file)
+            links: dict = {link: path.join(name_space, '00', link) \
+                for link in ('a', 'dup1', 'b', 'dup2')}
+            self.assertEqual(len(done), 2)
+            self.assertIn(links['a'], done)
+            self.assertIn(links['b'], done)
+            self.assertEqual(failed, {links['dup1']: path.join(data, '00', 'a'), \
+                links['dup2']: path.join(data, '00', 'a')})
+            self.assertEqual(readlink(path.join(new_name_space, '00', 'a')), \
+                path.join(new_data, '00', 'a'))
+            self.assertFalse(path.lexists(path.join(new_name_space, '00', 'dup1')))
+            self.assertFalse(path.exists(path.join(data, '00', 'a')))
+
+
+if __name__ == '__main__':
+    main()
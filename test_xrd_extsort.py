@@ -0,0 +1,98 @@
+#!/usr/bin/python3
+# vim: set fileencoding=utf-8 :
+'''
+Tests of xrd_extsort.py
+'''
+from io import StringIO
+from os import listdir, path
+from random import Random
+from tempfile import TemporaryDirectory
+from unittest import TestCase, main
+
+from xrd_extsort import ExternalSorter, RecordSpool, read_records
+
+
+class ReadRecordsTest(TestCase):
+    '''
+    read_records()
+    '''
+    def test_records_across_chunks(self) -> None:
+        '''
+        Records split by chunk boundaries are joined
+        '''
+        text: str = 'first\x00second\x00\x00last\x00'
+        for chunk_size in (1, 2, 3, 7, 1 << 20):
+            self.assertEqual(list(read_records(StringIO(text), chunk_size=chunk_size)), \
+                ['first', 'second', '', 'last'])
+
+    def test_torn_final_record(self) -> None:
+        '''
+        Record without its terminating NUL is dropped
+        '''
+        for chunk_size in (1, 4, 1 << 20):
+            self.assertEqual(list(read_records(StringIO('a\x00b\x00torn'), \
+                chunk_size=chunk_size)), ['a', 'b'])
+        self.assertEqual(list(read_records(StringIO('torn'))), [])
+        self.assertEqual(list(read_records(StringIO(''))), [])
+
+    def test_fields(self) -> None:
+        '''
+        Records of several fields, an incomplete last record is dropped
+        '''
+        text: str = 'a\x001\x00b\x002\x00c\x00'
+        for chunk_size in (1, 3, 1 << 20):
+            self.assertEqual(list(read_records(StringIO(text), 2, chunk_size)), \
+                [('a', '1'), ('b', '2')])
+
+
+class ExternalSorterTest(TestCase):
+    '''
+    ExternalSorter
+    '''
+    def test_sorted_runs(self) -> None:
+        '''
+        Records spilled to many runs come back sorted, close() removes the runs
+        '''
+        records: list = [f'/xrd/{Random(7).random()}/{number}' for number in range(1_000)]
+        Random(3).shuffle(records)
+        with TemporaryDirectory() as root:
+            with ExternalSorter(root, run_size=64) as sorter:
+                for record in records:
+                    sorter.add(record)
+                self.assertEqual(len(sorter), len(records))
+                self.assertGreater(len(listdir(sorter.directory)), 10)
+                self.assertEqual(list(sorter.sorted()), sorted(records))
+            self.assertEqual(listdir(root), [])
+
+    def test_fields(self) -> None:
+        '''
+        Tuples are sorted by all fields
+        '''
+        records: list = [(f'target{number % 7}', f'link{number}') for number in range(100)]
+        with TemporaryDirectory() as root, ExternalSorter(root, run_size=9, fields=2) as sorter:
+            for record in reversed(records):
+                sorter.add(record)
+            self.assertEqual(list(sorter.sorted()), sorted(records))
+
+
+class RecordSpoolTest(TestCase):
+    '''
+    RecordSpool
+    '''
+    def test_order_kept(self) -> None:
+        '''
+        Records come back in the order they were added, close() removes the spool file
+        '''
+        records: list = ['b', 'a', '', b'\xff'.decode('utf-8', 'surrogateescape'), 'c/d']
+        with TemporaryDirectory() as root:
+            spool: RecordSpool = RecordSpool(root)
+            for record in records:
+                spool.add(record)
+            self.assertEqual(len(spool), len(records))
+            self.assertEqual(list(spool.records()), records)
+            spool.close()
+            self.assertFalse(path.exists(spool.file))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/python3
+# vim: set fileencoding=utf-8 :
+'''
+Tests of xrd_journal.py
+'''
+from os import path
+from tempfile import TemporaryDirectory
+from unittest import TestCase, main
+
+from xrd_journal import DONE, FAILED_LINK, FAILED_RSYNC, DrainJournal, load_journal
+
+
+class JournalTest(TestCase):
+    '''
+    DrainJournal and load_journal()
+    '''
+    def test_states(self) -> None:
+        '''
+        The last state of a link wins, failed links keep the journal order
+        '''
+        with TemporaryDirectory() as root:
+            journal_file: str = path.join(root, 'journal')
+            journal: DrainJournal = DrainJournal(journal_file, True)
+            journal.record(FAILED_RSYNC, [('/ns/a', '/data/a'), ('/ns/b', '/data/b')])
+            journal.record(DONE, [('/ns/a', '/data/a'), ('/ns/c', '/data/c')])
+            journal.record(FAILED_LINK, [('/ns/d', '/data/d')])
+            journal.record(DONE, [])
+            journal.close()
+            done, failed = load_journal(journal_file)
+            self.assertEqual(len(done), 2)
+            self.assertIn('/ns/a', done)
+            self.assertIn('/ns/c', done)
+            self.assertEqual(list(failed.items()), [('/ns/b', '/data/b'), ('/ns/d', '/data/d')])
+
+    def test_missing_journal(self) -> None:
+        '''
+        Missing journal is empty
+        '''
+        with TemporaryDirectory() as root:
+            done, failed = load_journal(path.join(root, 'missing'))
+            self.assertEqual((len(done), failed), (0, {}))
+
+    def test_torn_record_is_truncated(self) -> None:
+        '''
+        Record torn by a crash is ignored and cut off, new records follow the last complete one
+        '''
+        for torn in (b'd', b'done\x00/ns/b', b'done\x00/ns/b\x00/data/b'):
+            with TemporaryDirectory() as root:
+                journal_file: str = path.join(root, 'journal')
+                journal: DrainJournal = DrainJournal(journal_file, True)
+                journal.record(DONE, [('/ns/a', '/data/a')])
+                journal.close()
+                complete: int = path.getsize(journal_file)
+                with open(journal_file, 'ab') as journal_handle:
+                    journal_handle.write(torn)
+                done, failed = load_journal(journal_file)
+                self.assertEqual(path.getsize(journal_file), complete, torn)
+                self.assertIn('/ns/a', done)
+                self.assertNotIn('/ns/b', done)
+                self.assertEqual(failed, {})
+                journal = DrainJournal(journal_file)
+                journal.record(FAILED_RSYNC, [('/ns/b', '/data/b')])
+                journal.close()
+                done, failed = load_journal(journal_file)
+                self.assertEqual(len(done), 1)
+                self.assertEqual(failed, {'/ns/b': '/data/b'})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/python3
+# vim: set fileencoding=utf-8 :
+'''
+Tests of xrd_pathstore.py
+'''
+from unittest import TestCase, main
+
+from xrd_pathstore import PathStore
+
+
+def colliding(store: PathStore) -> PathStore:
+    '''
+    Makes every path of store hash to the same 64-bit key
+    '''
+    split = store.split
+    store.split = lambda entry_path, create: (7,) + split(entry_path, create)[1:]
+    return store
+
+
+class PathStoreTest(TestCase):
+    '''
+    PathStore
+    '''
+    def test_membership(self) -> None:
+        '''
+        Added paths are found through table growth, others are not
+        '''
+        for keep_names in (False, True):
+            store: PathStore = PathStore(keep_names=keep_names)
+            paths: list = [f'/xrd/{number % 97}/file{number}' for number in range(20_000)]
+            for entry_path in paths:
+                self.assertTrue(store.add(entry_path))
+            self.assertFalse(store.add(paths[0]))
+            self.assertEqual(len(store), len(paths))
+            self.assertTrue(all(entry_path in store for entry_path in paths))
+            self.assertNotIn('/xrd/1/file0', store)
+            self.assertNotIn('/unknown/file1', store)
+            self.assertNotIn('/xrd/0', store)
+
+    def test_iteration(self) -> None:
+        '''
+        Only stores with names are iterable, in insertion order
+        '''
+        paths: list = ['/b/c', '/a/b', '/top', '/a/c']
+        store: PathStore = PathStore(keep_names=True)
+        store.update(paths)
+        self.assertEqual(list(store), paths)
+        with self.assertRaises(TypeError):
+            list(PathStore())
+
+    def test_hash_collisions(self) -> None:
+        '''
+        Paths with the same 64-bit hash in the same directory are told apart
+        '''
+        for keep_names in (False, True):
+            store: PathStore = colliding(PathStore(keep_names=keep_names))
+            paths: list = [f'/xrd/file{number}' for number in range(3_000)]
+            for entry_path in paths:
+                self.assertTrue(store.add(entry_path), entry_path)
+            self.assertEqual(len(store), len(paths))
+            self.assertTrue(all(entry_path in store for entry_path in paths))
+            self.assertNotIn('/xrd/other', store)
+            self.assertFalse(store.add('/xrd/file5'))
+            if keep_names:
+                self.assertEqual(sorted(store), sorted(paths))
+
+    def test_name_hash_is_checked(self) -> None:
+        '''
+        Membership only store rejects a different name of the same key and directory
+        '''
+        store: PathStore = colliding(PathStore())
+        store.add('/xrd/present')
+        self.assertIn('/xrd/present', store)
+        self.assertNotIn('/xrd/absent', store)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/python3
+# vim: set fileencoding=utf-8 :
+'''
+Tests of xrd_remote.py, sh -c stands in for the ssh command line
+(the bootstrapped helper command is its $0)
+'''
+from os import path
+from tempfile import TemporaryDirectory
+from unittest import TestCase, main
+
+from xrd_remote import RemoteHelper, check_helper
+
+
+class RemoteHelperTest(TestCase):
+    '''
+    Requests to the bootstrapped helper
+    '''
+    def test_local_helper(self) -> None:
+        '''
+        Empty ssh command runs the bootstrapped helper locally
+        '''
+        with TemporaryDirectory() as root:
+            helper: RemoteHelper = RemoteHelper([])
+            try:
+                response: dict = helper.request('mkdir', paths=[path.join(root, 'a/b')])
+            finally:
+                helper.close()
+            self.assertTrue(response['ok'], response)
+            self.assertTrue(path.isdir(path.join(root, 'a/b')))
+        self.assertEqual(check_helper([], '/'), '')
+
+    def test_shell_output_is_skipped(self) -> None:
+        '''
+        Lines printed by the remote shell before the helper starts are not answers
+        '''
+        helper: RemoteHelper = RemoteHelper(['/bin/sh', '-c', \
+            'echo Welcome to the storage; echo 42; echo "[1]"; eval "$0"'])
+        try:
+            first: dict = helper.request('space', path='/')
+            second: dict = helper.request('load')
+        finally:
+            helper.close()
+        self.assertTrue(first['ok'], first)
+        self.assertIn('space', first)
+        self.assertTrue(second['ok'], second)
+        self.assertIn('load', second)
+
+    def test_dead_helper_reports_stderr(self) -> None:
+        '''
+        Helper exiting without an answer is reported with its stderr and skipped output
+        '''
+        helper: RemoteHelper = RemoteHelper(['/bin/sh', '-c', \
+            'echo Welcome; echo python3: not found >&2; exit 127'])
+        try:
+            response: dict = helper.request('load')
+        finally:
+            helper.close()
+        self.assertFalse(response['ok'])
+        self.assertIn('127', response['error'])
+        self.assertIn('python3: not found', response['error'])
+        self.assertIn('Welcome', response['error'])
+        self.assertIn('python3: not found', \
+            check_helper(['/bin/sh', '-c', 'echo python3: not found >&2; exit 127']))
+
+    def test_read_reply_raises_on_exit(self) -> None:
+        '''
+        read_reply() raises RuntimeError when the helper exits
+        '''
+        helper: RemoteHelper = RemoteHelper(['/bin/sh', '-c', 'echo lost >&2'])
+        helper.start()
+        try:
+            with self.assertRaisesRegex(RuntimeError, 'stderr: lost'):
+                helper.read_reply()
+        finally:
+            helper.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/python3
+# vim: set fileencoding=utf-8 :
+'''
+Tests of xrd_walk.py, scan() is compared with os.walk()
+'''
+from os import fsdecode, makedirs, path, readlink, symlink, walk
+from tempfile import TemporaryDirectory
+from unittest import TestCase, main
+
+from xrd_index import ScanIndex
+from xrd_walk import DIRECTORY, FILE, LINK, scan
+
+
+def build_tree(root: str) -> str:
+    '''
+    Creates name space like tree with files, links and directories, returns its top
+    '''
+    top: str = path.join(root, 'top')
+    for first in range(3):
+        for second in range(4):
+            directory: str = path.join(top, f'{first:02}', f'{second:05}')
+            makedirs(directory)
+            # Non ASCII and not valid UTF-8 names
+            for name in ('a', 'b c', fsdecode(b'\xc3\xbc\xff')):
+                with open(path.join(directory, name), 'wb') as file_handle:
+                    file_handle.write(b'data')
+    makedirs(path.join(top, 'empty', 'deeper'))
+    symlink(path.join(top, '00', '00000', 'a'), path.join(top, 'absolute'))
+    symlink(path.join('00000', 'b c'), path.join(top, '00', 'relative'))
+    symlink(path.join(root, 'missing'), path.join(top, 'dangling'))
+    symlink(path.join(top, '01'), path.join(top, 'to_directory'))
+    return top
+
+
+def expected_entries(top: str) -> set:
+    '''
+    (path, kind, target of links to existing files) of all entries below top by os.walk()
+    '''
+    entries: set = set()
+    for directory, directories, files in walk(top):
+        for name in directories + files:
+            entry_path: str = path.join(directory, name)
+            if path.islink(entry_path):
+                target: str = path.normpath(path.join(directory, readlink(entry_path)))
+                entries.add((entry_path, LINK, target if path.isfile(target) else ''))
+            elif path.isfile(entry_path):
+                entries.add((entry_path, FILE, None))
+            else:
+                entries.add((entry_path, DIRECTORY, None))
+    return entries
+
+
+def scanned_entries(top: str, **options) -> set:
+    '''
+    Same as expected_entries() by scan()
+    '''
+    found: list = [(entry.path, entry.kind, entry.target if entry.kind == LINK else None) \
+        for entry in scan(top, resolve_links=True, **options)]
+    if len(found) != len(set(found)):
+        raise AssertionError('scan() yielded an entry more than once')
+    return set(found)
+
+
+class ScanTest(TestCase):
+    '''
+    scan() against os.walk()
+    '''
+    def test_threads(self) -> None:
+        '''
+        Threaded scan with small batches finds the same entries
+        '''
+        with TemporaryDirectory() as root:
+            top: str = build_tree(root)
+            expected: set = expected_entries(top)
+            for threads in (1, 4):
+                self.assertEqual(scanned_entries(top, threads=threads, batch_size=3), expected)
+
+    def test_processes(self) -> None:
+        '''
+        Process pool scan finds the same entries
+        '''
+        with TemporaryDirectory() as root:
+            top: str = build_tree(root)
+            self.assertEqual(scanned_entries(top, processes=2, batch_size=5), \
+                expected_entries(top))
+
+    def test_index(self) -> None:
+        '''
+        Scans with an index find the same entries, also when it is reused
+        '''
+        with TemporaryDirectory() as root:
+            top: str = build_tree(root)
+            expected: set = expected_entries(top)
+            for _ in range(2):
+                index: ScanIndex = ScanIndex(path.join(root, 'index'))
+                try:
+                    self.assertEqual(scanned_entries(top, threads=3, index=index), expected)
+                finally:
+                    index.close()
+
+    def test_missing_top(self) -> None:
+        '''
+        Missing top yields nothing
+        '''
+        with TemporaryDirectory() as root:
+            self.assertEqual(list(scan(path.join(root, 'missing'))), [])
+
+
+if __name__ == '__main__':
+    main()
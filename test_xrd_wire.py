@@ -0,0 +1,81 @@
+#!/usr/bin/python3
+# vim: set fileencoding=utf-8 :
+'''
+Tests of xrd_wire.py
+'''
+from unittest import TestCase, main
+
+from xrd_wire import decode_paths, encode_paths
+
+PATHS: list = sorted([
+    '/xrd/space/00/00001/file',
+    '/xrd/space/00/00001/file.1',
+    '/xrd/space/00/00002/other',
+    '/xrd/space/01/ünïcödé',
+    # Not valid UTF-8 on disk, decoded by surrogateescape
+    b'/xrd/space/02/\xff\xfe'.decode('utf-8', 'surrogateescape'),
+    '/',
+    'relative/path',
+    '/xrd/' + 'long' * 2_000,
+])
+
+
+def round_trip(paths: list, **options) -> list:
+    '''
+    Encodes paths and decodes them back
+    '''
+    return list(decode_paths(encode_paths(paths, **options)))
+
+
+class WireTest(TestCase):
+    '''
+    encode_paths() and decode_paths()
+    '''
+    def test_round_trip(self) -> None:
+        '''
+        Paths come back unchanged and in order
+        '''
+        self.assertEqual(round_trip(PATHS), PATHS)
+        self.assertEqual(round_trip(list(reversed(PATHS))), list(reversed(PATHS)))
+        self.assertEqual(round_trip([]), [])
+        self.assertEqual(round_trip(['same', 'same', '']), ['same', 'same', ''])
+
+    def test_blocks_and_chunks(self) -> None:
+        '''
+        Small blocks and single byte chunks split records anywhere
+        '''
+        paths: list = [f'/xrd/space/{number:05}/{number}' for number in range(3_000)]
+        self.assertEqual(round_trip(paths, block_size=7, level=1), paths)
+        encoded: bytes = b''.join(encode_paths(paths))
+        chunks: list = [encoded[position:position + 1] for position in range(len(encoded))]
+        self.assertEqual(list(decode_paths(chunks)), paths)
+
+    def test_front_coding_compresses(self) -> None:
+        '''
+        Shared prefixes cost almost nothing
+        '''
+        paths: list = [f'/xrd/space/storage/{number:08}' for number in range(10_000)]
+        encoded: bytes = b''.join(encode_paths(paths))
+        self.assertLess(len(encoded), sum(len(entry) for entry in paths) // 10)
+
+    def test_truncated_listing(self) -> None:
+        '''
+        Cut stream raises ValueError after the complete records
+        '''
+        encoded: bytes = b''.join(encode_paths(PATHS))
+        decoded: list = []
+        with self.assertRaises(ValueError):
+            for entry in decode_paths([encoded[:-3]]):
+                decoded.append(entry)
+        self.assertEqual(decoded, PATHS[:len(decoded)])
+
+    def test_corrupted_listing(self) -> None:
+        '''
+        Garbage raises ValueError
+        '''
+        with self.assertRaises(ValueError):
+            list(decode_paths([b'not a zlib stream']))
+
+
+if __name__ == '__main__':
+    main()
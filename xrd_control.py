@@ -0,0 +1,341 @@
+#!/usr/bin/python3
+# vim: set fileencoding=utf-8 :
+# Version 1.0.0
+'''
+Runtime control of drain workers shared by all pool processes.
+AIMDController grows the number of active workers (doubling at start, then by one)
+while the measured throughput keeps up and halves it on connection failures
+or destination overload.
+RateLimiter keeps token buckets of bytes/s and files/s, its limits are read
+from a limits file (reloaded when it changes) which may also hold a schedule.
+SizeScheduler reorders queued work by size within a bounded window.
+Their shared values must be created before the pool is forked.
+'''
+from bisect import insort
+from collections import deque
+from ctypes import c_longlong
+from itertools import count
+from multiprocessing import Array, Lock, Value
+from os import stat
+from re import match
+from threading import Event
+from time import localtime, monotonic, sleep
+from typing import Callable, Iterator, Union
+
+CONTROL_INTERVAL: float = 10.0
+IDLE_WAIT: float = 0.5
+# Throughput drop still considered as "no worse"
+TOLERANCE: float = 0.05
+# Destination load average per CPU considered as overload
+LOAD_LIMIT: float = 1.0
+
+SCHEDULE_WINDOW: int = 10_000
+ORDERS: set = {'fifo', 'largest', 'mixed'}
+LIMITS_INTERVAL: float = 1.0
+# Burst allowed by the token buckets, in seconds of the rate
+BURST: float = 1.0
+UNITS: dict = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+LIMITS_LINE: str = \
+    r'^(?:(\d\d):(\d\d)-(\d\d):(\d\d)\s+)?(\d+(?:\.\d+)?)([KMGT]?)\s+(\d+(?:\.\d+)?)$'
+
+FILES: int = 0
+BYTES: int = 1
+FAILURES: int = 2
+COUNTERS: int = 3
+
+
+class AIMDController:
+    '''
+    Additive increase / multiplicative decrease of the number of active workers
+    '''
+    def __init__(self, maximum: int, minimum: int = 1, initial: int = 0) -> None:
+        self.maximum: int = max(maximum, 1)
+        self.minimum: int = min(max(minimum, 1), self.maximum)
+        self.limit: Value = Value('i', \
+            min(max(initial or self.maximum // 10, self.minimum), self.maximum))
+        # Slots taken by the running workers, freed ones are reused by their replacements
+        self.slots: Array = Array('b', self.maximum)
+        self.stopped: Value = Value('b', 0, lock=False)
+        self.counters: Array = Array(c_longlong, COUNTERS)
+        self.last: tuple = (monotonic(), 0, 0, 0)
+        self.last_rates: tuple = (0.0, 0.0)
+        # Doubling until the first decrease, like TCP slow start
+        self.slow_start: bool = True
+
+    def take_slot(self) -> int:
+        '''
+        Returns the lowest free slot number (starts at 0) for calling worker,
+        maximum when all are taken, give it back by free_slot()
+        '''
+        with self.slots.get_lock():
+            for slot, taken in enumerate(self.slots):
+                if not taken:
+                    self.slots[slot] = 1
+                    return slot
+        return self.maximum
+
+    def free_slot(self, slot: int) -> None:
+        '''
+        Gives back slot of finished worker
+        '''
+        if slot < self.maximum:
+            with self.slots.get_lock():
+                self.slots[slot] = 0
+
+    def wait_for_turn(self, slot: int) -> None:
+        '''
+        Blocks worker while its slot is above the current limit, until release()
+        '''
+        while slot >= self.limit.value and not self.stopped.value:
+            sleep(IDLE_WAIT)
+
+    def release(self) -> None:
+        '''
+        Lets all workers run (e.g. to let them read their end marks)
+        '''
+        self.stopped.value = 1
+        self.limit.value = self.maximum
+
+    def count(self, files: int = 0, transferred: int = 0, failures: int = 0) -> None:
+        '''
+        Adds finished files, transferred bytes and connection failures
+        '''
+        with self.counters.get_lock():
+            self.counters[FILES] += files
+            self.counters[BYTES] += transferred
+            self.counters[FAILURES] += failures
+
+    def adjust(self, load: Union[float, None] = None) -> tuple:
+        '''
+        One control step, returns (old limit, new limit, bytes/s, files/s)
+        '''
+        with self.counters.get_lock():
+            files, transferred, failures = self.counters[:]
+        now: float = monotonic()
+        last_time, last_files, last_transferred, last_failures = self.last
+        elapsed: float = max(now - last_time, 1e-9)
+        rates: tuple = ((transferred - last_transferred) / elapsed, (files - last_files) / elapsed)
+        old_limit: int = self.limit.value
+        if failures > last_failures or (load is not None and load > LOAD_LIMIT):
+            new_limit: int = max(old_limit // 2, self.minimum)
+            self.slow_start = False
+        elif rates[0] >= self.last_rates[0] * (1 - TOLERANCE) \
+            or rates[1] >= self.last_rates[1] * (1 - TOLERANCE):
+            new_limit = min(old_limit * 2 if self.slow_start else old_limit + 1, self.maximum)
+        else:
+            # Last added workers made it worse
+            new_limit = max(old_limit - 1, self.minimum)
+            self.slow_start = False
+        self.limit.value = new_limit
+        self.last = (now, files, transferred, failures)
+        self.last_rates = rates
+        return (old_limit, new_limit) + rates
+
+    def run(self,
+        stop: Event,
+        load_probe: Union[Callable, None] = None,
+        report: Union[Callable, None] = None,
+        interval: float = CONTROL_INTERVAL) -> None:
+        '''
+        Control loop (run in a thread of the main process) until stop is set,
+        load_probe returns destination load per CPU (or None),
+        report receives the result of every adjust()
+        '''
+        while not stop.wait(interval):
+            load: Union[float, None] = load_probe() if load_probe else None
+            step: tuple = self.adjust(load)
+            if report:
+                report(*step, load)
+
+
+class TokenBucket:
+    '''
+    Token bucket shared by all processes, rate 0 means unlimited
+    '''
+    def __init__(self, rate: float = 0.0) -> None:
+        self.lock: Lock = Lock()
+        self.rate: Value = Value('d', rate, lock=False)
+        self.tokens: Value = Value('d', rate * BURST, lock=False)
+        self.last: Value = Value('d', monotonic(), lock=False)
+
+    def set_rate(self, rate: float) -> None:
+        '''
+        Changes the rate, unused tokens are kept up to the new burst
+        '''
+        with self.lock:
+            self.rate.value = rate
+            self.tokens.value = min(self.tokens.value, rate * BURST)
+
+    def acquire(self, amount: float) -> float:
+        '''
+        Takes amount tokens, sleeps while the bucket is in debt,
+        returns time spent waiting
+        '''
+        with self.lock:
+            rate: float = self.rate.value
+            if rate <= 0:
+                return 0.0
+            now: float = monotonic()
+            tokens: float = min(self.tokens.value + (now - self.last.value) * rate, rate * BURST)
+            self.last.value = now
+            # Bigger amounts than burst are allowed, the bucket goes into debt
+            self.tokens.value = tokens - amount
+        wait: float = max(amount - tokens, 0.0) / rate
+        if wait:
+            sleep(wait)
+        return wait
+
+
+def parse_size(number: str, unit: str = '') -> float:
+    '''
+    "1.5", "G" -> 1.5 * 2**30
+    '''
+    return float(number) * UNITS[unit]
+
+
+def parse_limits(limits_text: str) -> list:
+    '''
+    Parses limits file lines "[HH:MM-HH:MM] bytes/s[K|M|G|T] files/s" (0 = unlimited,
+    "#" comments), returns [(start minute or None, end minute, bytes/s, files/s), ...]
+    '''
+    limits: list = []
+    for line in limits_text.splitlines():
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        parsed: Union[object, None] = match(LIMITS_LINE, line)
+        if parsed is None:
+            raise ValueError(f'Invalid limits line "{line}"')
+        start_hour, start_minute, end_hour, end_minute, rate, unit, files = parsed.groups()
+        if start_hour is None:
+            limits.append((None, None, parse_size(rate, unit), float(files)))
+        else:
+            limits.append((int(start_hour) * 60 + int(start_minute), \
+                int(end_hour) * 60 + int(end_minute), parse_size(rate, unit), float(files)))
+    return limits
+
+
+def current_limits(limits: list, minute: int) -> tuple:
+    '''
+    Returns (bytes/s, files/s) valid at minute of day,
+    the first matching time range wins, otherwise the line without time range
+    '''
+    default: tuple = (0.0, 0.0)
+    for start, end, rate, files in limits:
+        if start is None:
+            default = (rate, files)
+        elif (start <= minute < end) if start <= end else (minute >= start or minute < end):
+            return (rate, files)
+    return default
+
+
+class RateLimiter:
+    '''
+    Limits bytes/s and files/s of all workers together
+    '''
+    def __init__(self) -> None:
+        self.bytes: TokenBucket = TokenBucket()
+        self.files: TokenBucket = TokenBucket()
+        self.limits: list = []
+        self.applied: tuple = (0.0, 0.0)
+
+    def acquire(self, files: int, transferred: int) -> float:
+        '''
+        Waits until files and bytes may be transferred, returns waiting time
+        '''
+        return self.files.acquire(files) + self.bytes.acquire(transferred)
+
+    def apply(self, minute: int) -> Union[tuple, None]:
+        '''
+        Sets limits valid at minute of day, returns them when they changed
+        '''
+        limits: tuple = current_limits(self.limits, minute)
+        if limits == self.applied:
+            return None
+        self.bytes.set_rate(limits[0])
+        self.files.set_rate(limits[1])
+        self.applied = limits
+        return limits
+
+    def run(self,
+        stop: Event,
+        limits_file: str,
+        reload: Event,
+        report: Union[Callable, None] = None) -> None:
+        '''
+        Reloads limits_file when it changes or reload is set (e.g. by SIGHUP)
+        and follows its schedule until stop is set,
+        report receives (bytes/s, files/s) or the error of the limits file
+        '''
+        mtime: int = -1
+        while True:
+            try:
+                current_mtime: int = stat(limits_file).st_mtime_ns
+            except OSError:
+                # Missing limits file keeps the last limits
+                current_mtime = mtime
+            if current_mtime != mtime or reload.is_set():
+                reload.clear()
+                mtime = current_mtime
+                try:
+                    with open(limits_file, 'r', encoding='utf-8') as limits_handle:
+                        self.limits = parse_limits(limits_handle.read())
+                    self.applied = (-1.0, -1.0)
+                except (OSError, ValueError) as exception:
+                    if report:
+                        report(exception)
+            now: tuple = localtime()
+            changed: Union[tuple, None] = self.apply(now.tm_hour * 60 + now.tm_min)
+            if changed and report:
+                report(changed)
+            if stop.wait(LIMITS_INTERVAL):
+                break
+
+
+class SizeScheduler:
+    '''
+    Holds up to window items and hands them out in given order:
+    fifo, largest (first) or mixed (largest and smallest alternately)
+    '''
+    def __init__(self, order: str = 'fifo', window: int = SCHEDULE_WINDOW) -> None:
+        if order not in ORDERS:
+            raise ValueError(f'Unknown order "{order}"')
+        self.order: str = order
+        self.window: int = max(window, 1)
+        self.fifo: deque = deque()
+        # (size, sequence, item) sorted by size, sequence keeps ties in arrival order
+        self.by_size: list = []
+        self.sequence: Iterator = count()
+        self.largest_next: bool = True
+
+    def add(self, size: int, item: object) -> None:
+        '''
+        Adds item of given size
+        '''
+        if self.order == 'fifo':
+            self.fifo.append(item)
+        else:
+            insort(self.by_size, (size, next(self.sequence), item))
+
+    def full(self) -> bool:
+        '''
+        True when the window is full and items have to be handed out
+        '''
+        return len(self) >= self.window
+
+    def pop(self) -> object:
+        '''
+        Returns next item by the order
+        '''
+        if self.order == 'fifo':
+            return self.fifo.popleft()
+        if self.order == 'largest' or self.largest_next:
+            item: object = self.by_size.pop()[2]
+        else:
+            item = self.by_size.pop(0)[2]
+        if self.order == 'mixed':
+            self.largest_next = not self.largest_next
+        return item
+
+    def __len__(self) -> int:
+        return len(self.fifo) + len(self.by_size)
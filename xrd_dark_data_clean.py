@@ -7,15 +7,29 @@ and than scans all data files,
 deleting all data files not found in namespace.
 It also finds all illegal namespace entires (not links)
 and allows them to be deleted.
+The default engine keeps the name space links in memory, data files wait
+for the end of the name space scan in temporary files.
+With --engine=merge link targets and data files are sorted on disk
+and compared by streaming merge, so memory does not grow with storage size.
 '''
-from os import path, readlink, remove, cpu_count, scandir
+from os import path, remove, cpu_count
 from sys import argv, exit, stdout, stderr # pylint: disable=redefined-builtin
 from subprocess import call
-from threading import Lock, Condition, Thread, Event
-from typing import Union, Generator, TextIO
+from re import match
+from heapq import merge
+from threading import Thread
+from typing import Callable, Generator, Union, TextIO
+from xrd_walk import scan, FILE, LINK
+from xrd_index import ScanIndex
+from xrd_pathstore import PathStore
+from xrd_extsort import ExternalSorter, RecordSpool
 
 TEXT_WIDTH: int = 150
 THREADS: int = cpu_count()*2
+PROCESSES: int = 0
+ENGINE: str = 'memory'
+TMP_DIRECTORY: str = ''
+INDEX: Union[ScanIndex, None] = None
 
 def status_print(print_line: str, keep: bool = True, error: bool = False) -> None:
     '''
@@ -34,82 +48,23 @@ def status_print(print_line: str, keep: bool = True, error: bool = False) -> Non
         stdout.flush()
 
 
-def walk(top: str,
-    threads: int = THREADS,
-    separate_links: bool = True,
-    full_paths: bool = True) -> Generator:
+def print_scan_stats(scan_stats: dict) -> None:
     '''
-    Multi-threaded version of os.walk() with some improvements
+    Reports how often the scanner had to wait for the processing
     '''
-    if not path.isdir(top):
-        return
-    lock: Lock = Lock()
-    on_input: Condition = Condition(lock)
-    on_output: Condition = Condition(lock)
-    state: dict = {'tasks': 1}
-    paths: set = {top}
-    output: list = []
-
-    def worker() -> None:
-        while True:
-            with lock:
-                while True:
-                    if not state['tasks']:
-                        output.append(None)
-                        on_output.notify()
-                        return
-                    if not paths:
-                        on_input.wait()
-                        continue
-                    fs_path: str = paths.pop()
-                    break
-            try:
-                dirs: set = set()
-                files: set = set()
-                links: set = set()
-                for item in scandir(fs_path):
-                    item_name: str = item.name
-                    if full_paths:
-                        item_name = item.path
-                    if item.is_symlink():
-                        if separate_links:
-                            links.add(item_name)
-                        else:
-                            files.add(item_name)
-                    elif item.is_file():
-                        files.add(item_name)
-                    else:
-                        dirs.add(item_name)
-                        with lock:
-                            state['tasks'] += 1
-                            paths.add(item.path)
-                            on_input.notify()
-                with lock:
-                    if separate_links:
-                        output.append((fs_path, dirs, files, links))
-                    else:
-                        output.append((fs_path, dirs, files))
-                    on_output.notify()
-            except OSError as exception:
-                status_print(exception, error=True)
-            finally:
-                with lock:
-                    state['tasks'] -= 1
-                    if not state['tasks']:
-                        on_input.notify_all()
-
-    workers: list = [Thread(target=worker, name=f'fastio.walk {i} {top}') for i in range(threads)]
-    for start_worker in workers:
-        start_worker.start()
-    while threads or output:  # TODO(jart): Why is 'or output' necessary?
-        with lock:
-            while not output:
-                on_output.wait()
-            item: tuple = output.pop()
-        if item:
-            yield item
-        else:
-            threads -= 1
+    status_print(f'Scanner was paused {scan_stats.get("stalls", 0):_} times '\
+        f'({scan_stats.get("stall_time", 0.0):.1f}s) waiting for processing')
+
+
+def pop_option(name: str, default: str = '') -> str:
+    '''
+    Removes all "--name=value" options from argv, returns the last value
+    '''
+    value: str = default
+    for option in [arg for arg in argv[1:] if arg.startswith(f'--{name}=')]:
+        argv.remove(option)
+        value = option.split('=', 1)[1]
+    return value
 
 
 def check_if_dir_exists(check_dir: str) -> None:
@@ -129,94 +84,100 @@ def clean_empty_dirs(directory_to_be_cleaned: str) -> None:
 
 def get_name_space_links(name_space_root: str) -> tuple:
     '''
-    Process the links in multithreaded way
+    Collects targets of all name space links, the scanner workers
+    resolve and check the link targets in their batches
     '''
-    getns_lock: Lock = Lock()
-    getns_on_input: Condition = Condition(getns_lock)
-    getns_on_output: Condition = Condition(getns_lock)
-    getns_event: Event = Event()
-    getns_state: dict = {
-        'iterator': 0,
-        'link_count': 0,
-        'links_to_process': set(),
-        'illegal_ns_data': set(),
-        'valid_links': set(),
-    }
-
-    def process_name_space_link(link_to_check: str) -> Union[str, None]:
-        '''
-        Checks if given path is link to existing file
-        '''
-        out: Union[str, None] = None
-        link_target: str = readlink(link_to_check)
-        # Check if link address is absolute
-        if not path.isabs(link_target):
-            # Create absolute link address
-            link_target = path.abspath(path.join(path.dirname(link_to_check), link_target))
-        if path.isfile(link_target):
-            out = link_target
-        return out
-
-    # Find all link targets in ns
-    for _, _, name_space_files, name_space_links in walk(name_space_root):
-        for getns_link in name_space_links:
-            getns_state['links_to_process'].add(getns_link)
-            getns_state['link_count'] += 1
-            if getns_state['link_count'] % 1000 == 0:
-                status_print(f'Found {getns_state["link_count"]:_} entries so far...', keep=False)
-        getns_state['illegal_ns_data'] = getns_state['illegal_ns_data'].union(name_space_files)
-    status_print(f'Found {getns_state["link_count"]:_} name space entries')
-
-    def getns_worker() -> None:
-        while True:
-            with getns_lock:
-                while True:
-                    if len(getns_state['links_to_process']) == 0:
-                        getns_on_output.notify()
-                        return
-                    getns_path: str = getns_state['links_to_process'].pop()
-                    getns_state['iterator'] += 1
-                    if (getns_state['iterator'] % 1_000) == 0:
-                        status_print(f'Processing NS entry {getns_state["iterator"]:_} of '\
-                            f'{getns_state["link_count"]:_}: {getns_path}', keep=False)
-                    break
-            getns_target: Union[str, None] = process_name_space_link(getns_path)
-            with getns_lock:
-                if getns_target and getns_target not in getns_state['valid_links']:
-                    getns_state['valid_links'].add(getns_target)
-                else:
-                    getns_state['illegal_ns_data'].add(getns_path)
-                if len(getns_state['links_to_process']) == 0:
-                    getns_on_input.notify_all()
-                if getns_event.is_set():
-                    getns_on_input.notify_all()
-                    break
-
-    getns_workers: list = [Thread(target=getns_worker, \
-        name=f'getns_worker {i} {name_space_root}') for i in range(THREADS)]
-    try:
-        for getns_start_worker in getns_workers:
-            getns_start_worker.start()
-    except KeyboardInterrupt:
-        getns_event.set()
-    for getns_start_worker in getns_workers:
-        getns_start_worker.join()
-    status_print(f'Found {len(getns_state["valid_links"]):_} valid name space entries')
-    return (getns_state['valid_links'], getns_state['illegal_ns_data'])
+    link_count: int = 0
+    illegal_ns_data: PathStore = PathStore(keep_names=True)
+    valid_links: PathStore = PathStore()
+    scan_stats: dict = {}
+    for name_space_entry in scan(name_space_root, THREADS, stats=scan_stats, \
+        processes=PROCESSES, index=INDEX, resolve_links=True):
+        if name_space_entry.kind == LINK:
+            link_count += 1
+            if link_count % 1_000 == 0:
+                status_print(f'Processing NS entry {link_count:_}: {name_space_entry.path}', \
+                    keep=False)
+            # add() returns False for a target already linked from other entry
+            if not (name_space_entry.target and valid_links.add(name_space_entry.target)):
+                illegal_ns_data.add(name_space_entry.path)
+        elif name_space_entry.kind == FILE:
+            illegal_ns_data.add(name_space_entry.path)
+    status_print(f'Found {link_count:_} name space entries')
+    print_scan_stats(scan_stats)
+    status_print(f'Found {len(valid_links):_} valid name space entries')
+    return (valid_links, illegal_ns_data)
+
+
+def scan_data_dir(data_dir: str, data_scan: dict) -> None:
+    '''
+    Sorts entries of one data dir into data files (to be checked
+    against the name space) and links (always dark data)
+    '''
+    data_files: Union[RecordSpool, ExternalSorter] = data_scan['data_files']
+    for data_entry in scan(data_dir, THREADS, stats=data_scan['stats'], processes=PROCESSES, \
+        index=INDEX):
+        if data_entry.kind == LINK:
+            data_scan['dark_data'].add(data_entry.path)
+        elif data_entry.kind == FILE:
+            data_files.add(data_entry.path)
+            if (len(data_files) % 1_000) == 0:
+                status_print(f'Found {len(data_files):_} data entries so far in {data_dir}', \
+                    keep=False)
+
+
+def start_data_scans(data_directories: list, data_store: Callable) -> list:
+    '''
+    Scans all data dirs in parallel (with each other and with the name space scan),
+    data_store creates the container for data files of one data dir
+    '''
+    data_scans: list = []
+    for data_dir in data_directories:
+        data_scan: dict = {
+            'data_dir': data_dir,
+            'data_files': data_store(),
+            'dark_data': PathStore(keep_names=True),
+            'stats': {},
+        }
+        data_scan['thread'] = Thread(target=scan_data_dir, args=(data_dir, data_scan), \
+            name=f'data_scan {data_dir}')
+        data_scan['thread'].start()
+        data_scans.append(data_scan)
+    return data_scans
+
+
+def join_data_scans(data_scans: list) -> PathStore:
+    '''
+    Waits for all data dir scans, returns the dark data found so far (links)
+    '''
+    dark_data: PathStore = PathStore(keep_names=True)
+    scan_stats: dict = {'stalls': 0, 'stall_time': 0.0}
+    for data_scan in data_scans:
+        data_scan['thread'].join()
+        dark_data.update(data_scan['dark_data'])
+        status_print(f'Found {len(data_scan["data_files"]):_} data entries '\
+            f'in {data_scan["data_dir"]}')
+        for stat in scan_stats:
+            scan_stats[stat] += data_scan['stats'].get(stat, 0)
+    print_scan_stats(scan_stats)
+    return dark_data
 
 
-def find_dark_data(data_directories: list, name_space_links: set) -> set:
+def find_dark_data(name_space_root: str, data_directories: list) -> tuple:
     '''
-    Checks the data dirs for dark data files
+    Scans name space and data dirs at the same time,
+    data files are spooled to disk (in TMP_DIRECTORY) and checked
+    once the name space links are complete
     '''
-    dark_data: set = set()
-    dark_iterator: int = 1
-    for data_dir in data_directories:
-        for _, _, data_files, data_links in walk(data_dir):
-            for data_link in data_links:
-                dark_data.add(data_link)
-            for data_file in data_files:
-                # Create file name
+    data_scans: list = start_data_scans(data_directories, lambda: RecordSpool(TMP_DIRECTORY))
+    name_space_links: PathStore
+    illegal_ns_data: PathStore
+    try:
+        name_space_links, illegal_ns_data = get_name_space_links(name_space_root)
+        dark_data: PathStore = join_data_scans(data_scans)
+        dark_iterator: int = 1
+        for data_scan in data_scans:
+            for data_file in data_scan['data_files'].records():
                 if (dark_iterator % 1_000) == 0:
                     status_print(f'Processing data entry {dark_iterator:_}: {data_file}', \
                         keep=False)
@@ -224,7 +185,72 @@ def find_dark_data(data_directories: list, name_space_links: set) -> set:
                 if not data_file in name_space_links:
                     dark_data.add(data_file)
                 dark_iterator += 1
-    return dark_data
+    finally:
+        for data_scan in data_scans:
+            data_scan['thread'].join()
+            data_scan['data_files'].close()
+    return (dark_data, illegal_ns_data)
+
+
+def unique_targets(sorted_targets: Generator, illegal_ns_data: PathStore) -> Generator:
+    '''
+    Yields each link target once, all other links to the same target are illegal
+    '''
+    last_target: Union[str, None] = None
+    for target, link in sorted_targets:
+        if target == last_target:
+            illegal_ns_data.add(link)
+        else:
+            last_target = target
+            yield target
+
+
+def find_dark_data_merge(name_space_root: str, data_directories: list) -> tuple:
+    '''
+    Sorts link targets and data files in external sort runs
+    and finds dark data by single streaming merge of both,
+    name space and data dirs are scanned at the same time
+    '''
+    illegal_ns_data: PathStore = PathStore(keep_names=True)
+    scan_stats: dict = {}
+    data_scans: list = start_data_scans(data_directories, \
+        lambda: ExternalSorter(TMP_DIRECTORY))
+    name_space_targets: ExternalSorter = ExternalSorter(TMP_DIRECTORY, fields=2)
+    try:
+        for name_space_entry in scan(name_space_root, THREADS, stats=scan_stats, \
+            processes=PROCESSES, index=INDEX, resolve_links=True):
+            if name_space_entry.kind == LINK:
+                name_space_link: str = name_space_entry.path
+                if name_space_entry.target:
+                    name_space_targets.add((name_space_entry.target, name_space_link))
+                    if len(name_space_targets) % 1_000 == 0:
+                        status_print(f'Found {len(name_space_targets):_} entries so far...', \
+                            keep=False)
+                else:
+                    illegal_ns_data.add(name_space_link)
+            elif name_space_entry.kind == FILE:
+                illegal_ns_data.add(name_space_entry.path)
+        status_print(f'Found {len(name_space_targets):_} name space entries '\
+            'pointing to existing files')
+        print_scan_stats(scan_stats)
+        dark_data: PathStore = join_data_scans(data_scans)
+        status_print('Merging sorted name space and data entries')
+        targets: Generator = unique_targets(name_space_targets.sorted(), illegal_ns_data)
+        target: Union[str, None] = next(targets, None)
+        for data_file in merge(*[data_scan['data_files'].sorted() for data_scan in data_scans]):
+            while target is not None and target < data_file:
+                target = next(targets, None)
+            if target != data_file:
+                dark_data.add(data_file)
+        # Finish the duplicate detection past the last data file
+        for _ in targets:
+            pass
+    finally:
+        for data_scan in data_scans:
+            data_scan['thread'].join()
+            data_scan['data_files'].close()
+        name_space_targets.close()
+    return (dark_data, illegal_ns_data)
 
 
 def delete(del_file) -> None:
@@ -253,7 +279,7 @@ def save_to_file(data: any) -> None:
                     'please select a different file path!')
             else:
                 break
-    if isinstance(data, (list, set)):
+    if isinstance(data, (list, set, PathStore)):
         data_out: str = '\n'.join(data)
     else:
         data_out = data
@@ -261,7 +287,7 @@ def save_to_file(data: any) -> None:
         savefile_handle.write(data_out)
 
 
-def handle_data(data_to_handle: set, dark: bool) -> None:
+def handle_data(data_to_handle: PathStore, dark: bool) -> None:
     '''
     Asks user for input and handles the entries
     '''
@@ -297,6 +323,17 @@ def handle_data(data_to_handle: set, dark: bool) -> None:
 
 
 if __name__ == '__main__':
+    PROCESSES_OPTION: str = pop_option('processes', '0')
+    if not match(r'^\d+$', PROCESSES_OPTION):
+        exit(f'{PROCESSES_OPTION} is not a valid number of processes.')
+    PROCESSES = int(PROCESSES_OPTION)
+    ENGINE = pop_option('engine', ENGINE)
+    if ENGINE not in {'memory', 'merge'}:
+        exit(f'{ENGINE} is not a valid engine, use "memory" or "merge".')
+    TMP_DIRECTORY = pop_option('tmpdir', TMP_DIRECTORY)
+    if TMP_DIRECTORY:
+        check_if_dir_exists(TMP_DIRECTORY)
+    INDEX_FILE: str = pop_option('index')
     OLD_ARGS: str = ''
     if len(argv) < 3:
         OLD_ARGS = f"\nYou gave:\n   {' '.join(argv)}"
@@ -304,23 +341,42 @@ if __name__ == '__main__':
 
     if ('-h' in argv) or ('--help' in argv):
         status_print('This script is to be used in this way:')
-        status_print(f'{argv[0]} /name/space/path /data/path/1 '\
+        status_print(f'{argv[0]} [--processes=N] [--engine=memory|merge] [--tmpdir=/path] '\
+            '[--index=/index/file] /name/space/path /data/path/1 '\
             '[/data/path/2] ... [/data/path/n] {OLD_ARGS}')
+        status_print('\t--processes=N scans the directories with N processes instead of threads.')
+        status_print('\t--engine=merge sorts the entries on disk (in --tmpdir) and merges them,')
+        status_print('\t  memory use stays bounded, "memory" (default) keeps namespace in RAM')
+        status_print('\t  and the data files in --tmpdir until the namespace is scanned.')
+        status_print('\t--index=/index/file keeps directory listings and link targets '\
+            'between runs,')
+        status_print('\t  only directories with changed mtime are listed again '\
+            '(threaded scan only).')
         exit(0)
 
     NAME_SPACE: str = argv[1]
     DATA_DIRS: list = argv[2:]
-    NAME_SPACE_LINKS: set
-    ILLEGAL_NAME_SPACE_ENTRIES: set
+    ILLEGAL_NAME_SPACE_ENTRIES: PathStore
+    DARK_DATA: PathStore
     check_if_dir_exists(NAME_SPACE)
     for DATA_DIR in DATA_DIRS:
         check_if_dir_exists(DATA_DIR)
 
+    if INDEX_FILE:
+        INDEX = ScanIndex(INDEX_FILE)
     status_print(f'Collecting all link targets in {NAME_SPACE}')
 
-    NAME_SPACE_LINKS, ILLEGAL_NAME_SPACE_ENTRIES = get_name_space_links(NAME_SPACE)
+    if ENGINE == 'merge':
+        DARK_DATA, ILLEGAL_NAME_SPACE_ENTRIES = find_dark_data_merge(NAME_SPACE, DATA_DIRS)
+    else:
+        DARK_DATA, ILLEGAL_NAME_SPACE_ENTRIES = find_dark_data(NAME_SPACE, DATA_DIRS)
+
+    if INDEX:
+        INDEX.close()
+        status_print(f'Index {INDEX_FILE}: reused {INDEX.stats["reused"]:_} directories, '\
+            f'rescanned {INDEX.stats["rescanned"]:_}')
 
-    handle_data(find_dark_data(DATA_DIRS, NAME_SPACE_LINKS), True)
+    handle_data(DARK_DATA, True)
 
     handle_data(ILLEGAL_NAME_SPACE_ENTRIES, False)
 
@@ -7,15 +7,89 @@ Conforms to the ALICE exepriment storage layout
 Tested on CentOS 7.
 '''
 from hashlib import md5
+from math import log
 from multiprocessing import Lock, Pool, Queue, cpu_count, current_process
-from os import path, readlink, remove, scandir
+import os
+from os import chown, fsdecode, fsencode, path, remove, rename, sendfile, stat, stat_result
+from queue import Empty
 from random import random
 from re import match, sub
-from subprocess import call
-from sys import argv, exit, stderr  # pylint: disable=redefined-builtin
-from threading import Condition, Thread, Event
-from threading import Lock as tLock
-from time import sleep
+from shutil import copystat
+from signal import SIGHUP, signal
+from subprocess import CompletedProcess, PIPE, call, run
+from sys import argv, exit  # pylint: disable=redefined-builtin
+from threading import Event, Thread
+from time import monotonic, sleep
+from typing import Union
+from xrd_walk import scan, link_target, FILE, LINK
+from xrd_index import ScanIndex
+from xrd_journal import DrainJournal, load_journal, DONE, FAILED_MKDIR, FAILED_LINK, FAILED_RSYNC
+from xrd_pathstore import PathStore
+from xrd_control import AIMDController, RateLimiter, SizeScheduler, parse_limits, ORDERS, \
+    BYTES, FAILURES, FILES
+from xrd_metrics import DrainMetrics, report_status, serve_metrics, status_line, STATUS_INTERVAL
+from xrd_remote import LocalHelper, RemoteHelper, check_helper
+
+
+
+def pop_options(name: str) -> list:
+    '''
+    Removes all "--name=value" options from argv, returns all values
+    '''
+    values: list = []
+    for option in [arg for arg in argv[1:] if arg.startswith(f'--{name}=')]:
+        argv.remove(option)
+        values.append(option.split('=', 1)[1])
+    return values
+
+
+def pop_option(name: str, default: str = '') -> str:
+    '''
+    Removes all "--name=value" options from argv, returns the last value
+    '''
+    values: list = pop_options(name)
+    return values[-1] if values else default
+
+
+INDEX_FILE: str = pop_option('index')
+BATCH_FILES_OPTION: str = pop_option('batch-files', '1')
+BATCH_BYTES_OPTION: str = pop_option('batch-bytes', '0')
+for batch_option in [BATCH_FILES_OPTION, BATCH_BYTES_OPTION]:
+    if not match(r'^\d+$', batch_option):
+        exit(f'{batch_option} is not a valid batch size.')
+BATCH_FILES: int = max(int(BATCH_FILES_OPTION), 1)
+BATCH_BYTES: int = int(BATCH_BYTES_OPTION)
+JOURNAL_FILE: str = pop_option('journal')
+LIMITS_FILE: str = pop_option('limits')
+ORDER: str = pop_option('order', 'fifo')
+if ORDER not in ORDERS:
+    exit(f'{ORDER} is not a valid order, use "fifo", "largest" or "mixed".')
+DESTINATION_OPTIONS: list = pop_options('destination')
+WEIGHT: str = pop_option('weight', '1')
+PLACEMENT: str = pop_option('placement', 'hash')
+if PLACEMENT not in {'hash', 'space'}:
+    exit(f'{PLACEMENT} is not a valid placement, use "hash" or "space".')
+STATUS_OPTION: str = pop_option('status', str(STATUS_INTERVAL))
+if not match(r'^\d+(\.\d+)?$', STATUS_OPTION):
+    exit(f'{STATUS_OPTION} is not a valid status interval.')
+STATUS_SECONDS: float = float(STATUS_OPTION)
+METRICS_OPTION: str = pop_option('metrics')
+if METRICS_OPTION and not match(r'^([^:]+:)?\d+$', METRICS_OPTION):
+    exit(f'{METRICS_OPTION} is not a valid metrics endpoint, use [address:]port.')
+# Local endpoint only by default
+METRICS_ADDRESS: str = METRICS_OPTION.rsplit(':', 1)[0] if ':' in METRICS_OPTION \
+    else '127.0.0.1'
+QUIET: bool = '--quiet' in argv
+if QUIET:
+    argv.remove('--quiet')
+ADAPTIVE: bool = '--adaptive' in argv
+if ADAPTIVE:
+    argv.remove('--adaptive')
+RESUME: bool = '--resume' in argv
+if RESUME:
+    argv.remove('--resume')
+    if not JOURNAL_FILE:
+        exit('--resume needs --journal=/journal/file')
 
 OLD_ARGS: str = ''
 if len(argv) not in {7, 8}:
@@ -24,20 +98,47 @@ if len(argv) not in {7, 8}:
 
 if ('-h' in argv) or ('--help' in argv):
     print('This script is to be used in this way:')
-    print(f'{argv[0]} /source/name/space/path /source/path [user@]destination.server[:port] '\
+    print(f'{argv[0]} [--index=/index/file] [--batch-files=N] [--batch-bytes=B] '\
+         '[--journal=/journal/file [--resume]] [--adaptive] [--limits=/limits/file] '\
+         '[--order=fifo|largest|mixed] '\
+         '[--destination=[user@]server[:port],/name/space/path,/path[,weight] ...] '\
+         '[--weight=W] [--placement=hash|space] '\
+         '[--status=seconds] [--metrics=[address:]port] [--quiet] '\
+         '/source/name/space/path /source/path '\
+         '[user@]destination.server[:port] '\
          '/destination/name/space/path /destination/path user:group [number of threads]')
     print('\tScript will perform the local move when the destination host is "localhost".')
     print('\tIf you prepend /source/path with "r" it will treat path as python regexp,')
     print('\tallowing you to drain multiple filesystems at once.')
+    print('\t--index=/index/file keeps source name space listings and link targets between runs,')
+    print('\tonly directories with changed mtime are listed again.')
+    print('\t--batch-files=N and --batch-bytes=B transfer up to N files (1 by default)')
+    print('\tor B bytes (no limit by default) from one data directory by a single rsync call.')
+    print('\t--journal=/journal/file records migrated and failed files,')
+    print('\twith --resume migrated files are skipped and failed ones are retried first.')
+    print('\t--adaptive starts with 1/10 of the threads and changes the number of active')
+    print('\tthreads by measured throughput, ssh failures and destination load,')
+    print('\tthe number of threads is the maximum then.')
+    print('\t--limits=/limits/file limits bytes/s and files/s of all threads together,')
+    print('\tthe file is reloaded when it changes or on SIGHUP, its lines are')
+    print('\t"[HH:MM-HH:MM] bytes/s[K|M|G|T] files/s" (0 is unlimited), e.g. "100M 0" and')
+    print('\t"08:00-20:00 20M 50" for full speed by night and throttled drain by day.')
+    print('\t--order=largest sends the largest waiting batches first, --order=mixed alternates')
+    print('\tthe largest and the smallest ones (batches are queued as found by default).')
+    print('\t--destination adds more destinations (with own threads and connections),')
+    print('\tfiles are spread by weights (--weight=W of the first destination, 1 by default)')
+    print('\tusing consistent hashing of their paths, or with --placement=space to the')
+    print('\tdestination with most free space times weight.')
+    print(f'\t--status=seconds prints progress every {STATUS_INTERVAL:g} seconds by default')
+    print('\t(0 disables it), --metrics=[address:]port serves the progress and latencies')
+    print('\tof the mkdir, rsync and link stages in Prometheus text format (on 127.0.0.1')
+    print('\tby default), --quiet does not print start and end of every transfer.')
 
     print(OLD_ARGS)
     exit(0)
 
 SOURCE_NAME_SPACE: str = argv[1]
 SOURCE_DATA: str = argv[2]
-DESTINATION_SERVER: str = argv[3]
-DESTINATION_NAME_SPACE: str = argv[4]
-DESTINATION_DATA: str = argv[5]
 FILE_OWNER_AND_GROUP: str = argv[6]
 SOURCE_ID: str = md5(
     f'{SOURCE_DATA}{str(random())}8ZS8s6tDDLOz+dDZVFTKaZ4mjIH'.encode('utf-8')
@@ -45,6 +146,17 @@ SOURCE_ID: str = md5(
 TRANSFER_COUNT: int = 1
 ILLEGAL_ENTRIES_IN_SOURCE_NAME_SPACE: set = set()
 SNYC_DIRECTORIES_ONLY: list = ['--include=*/', '--exclude=*']
+DIRECTORY_CHUNK: int = 1_000
+SSH_FAILURE: int = 255
+COPY_CHUNK: int = 1 << 30
+# Batches waiting in the queue for each worker
+QUEUED_BATCHES: int = 4
+# Partial batches kept open before the oldest is sent anyway
+PENDING_BATCHES: int = 10_000
+# Complete batches collected before their directories are created in bulk
+READY_BATCHES: int = 100
+# Seconds between free space checks of --placement=space
+SPACE_INTERVAL: float = 60.0
 
 MULTIPROCESS_THREADS: int = cpu_count()*2
 if len(argv) == 8 and match(r'^\d+$', str(argv[7])):
@@ -53,40 +165,84 @@ if len(argv) == 8 and match(r'^\d+$', str(argv[7])):
 if not match(r'[a-z][a-z0-9\\\-]+:[a-z][a-z0-9\\\-]+', FILE_OWNER_AND_GROUP):
     exit(f'{FILE_OWNER_AND_GROUP} is not a valid user:group definition.')
 
+if LIMITS_FILE:
+    try:
+        with open(LIMITS_FILE, 'r', encoding='utf-8') as limits_handle:
+            parse_limits(limits_handle.read())
+    except (OSError, ValueError) as limits_exception:
+        exit(f'{LIMITS_FILE} is not a valid limits file: {limits_exception}')
 
-DESTINATION_PORT: str = '22'
-if ':' in DESTINATION_SERVER:
-    DESTINATION_SERVER, DESTINATION_PORT = DESTINATION_SERVER.split(':')
 
-DESTINATION_SERVER_USER: str = 'root'
-if '@' in DESTINATION_SERVER:
-    DESTINATION_SERVER_USER, DESTINATION_SERVER = DESTINATION_SERVER.split('@')
+def parse_destination(destination_server: str,
+    name_space: str,
+    data: str,
+    weight: str = '1') -> dict:
+    '''
+    Destination [user@]server[:port] with its name space and data paths and weight
+    '''
+    destination_port: str = '22'
+    if ':' in destination_server:
+        destination_server, destination_port = destination_server.split(':')
+    destination_server_user: str = 'root'
+    if '@' in destination_server:
+        destination_server_user, destination_server = destination_server.split('@')
+    if not match(r'^\d+(\.\d+)?$', weight) or float(weight) <= 0:
+        exit(f'{weight} is not a valid weight of {destination_server}.')
+    return {
+        'server': destination_server,
+        'port': destination_port,
+        'user': destination_server_user,
+        'name_space': name_space,
+        'data': data,
+        'weight': float(weight),
+        'local': destination_server == 'localhost',
+    }
+
 
-LOCAL_MOVE: bool = bool(DESTINATION_SERVER == 'localhost')
+DESTINATIONS: list = [parse_destination(argv[3], argv[4], argv[5], WEIGHT)]
+for destination_option in DESTINATION_OPTIONS:
+    if destination_option.count(',') not in {2, 3}:
+        exit(f'{destination_option} is not a valid destination, '\
+            'use [user@]server[:port],/name/space/path,/path[,weight]')
+    DESTINATIONS.append(parse_destination(*destination_option.split(',')))
+for destination_index, destination_definition in enumerate(DESTINATIONS):
+    # Separates ssh sockets of the destinations
+    destination_definition['id'] = f'{SOURCE_ID}-{destination_index}'
 
 
-def ssh_connection(socket_id: str=SOURCE_ID) -> list:
+def ssh_connection(destination: dict, socket_id: str = '') -> list:
     '''
-    ssh connection details
+    ssh connection details, socket_id separates the sockets of the workers
     '''
+    socket: str = f'{destination["id"]}-{socket_id}' if socket_id else destination['id']
     return [
         '/usr/bin/ssh',
         '-o', 'ControlMaster=auto',
-        '-o', f'ControlPath=/dev/shm/.xrd-drain-{socket_id}.socket',
+        '-o', f'ControlPath=/dev/shm/.xrd-drain-{socket}.socket',
         '-o', 'ControlPersist=1200',
         '-o', 'Compression=no',
         '-x',
         '-T',
-        '-p', DESTINATION_PORT,
-        '-l', DESTINATION_SERVER_USER
+        '-p', destination['port'],
+        '-l', destination['user']
     ]
 
 
-def ssh_connection_formated(socket_id_f: str=SOURCE_ID) -> str:
+def ssh_connection_formated(destination: dict, socket_id_f: str = '') -> str:
     '''
     Formated ssh connection
     '''
-    return f"{' '.join(ssh_connection(socket_id_f))} "
+    return f"{' '.join(ssh_connection(destination, socket_id_f))} "
+
+
+def destination_helper(destination: dict,
+    socket_id: str = '') -> Union[RemoteHelper, LocalHelper]:
+    '''
+    Persistent helper on the destination (in-process one for the local move)
+    '''
+    if destination['local']:
+        return LocalHelper()
+    return RemoteHelper(ssh_connection(destination, socket_id) + [destination['server']])
 
 
 def check_if_directory_exists(check_directory: str) -> None:
@@ -126,117 +282,330 @@ def remove_double_slashes(string: str) -> str:
     return sub('//', '/', string)
 
 
-def rsync(command: list, rsocket_name: str=SOURCE_ID) -> int:
+def destination_paths(source_link: str, source_file: str, destination: dict) -> tuple:
     '''
-    Call rsync with given arguments (Pass only options to this function)
+    Returns (destination file, destination link) of source link and file
     '''
-    if LOCAL_MOVE:
-        command: list = flatten(['/usr/bin/rsync', '-a', command])
-    else:
-        command: list = flatten(['/usr/bin/rsync', '-a', '-e', \
-            ssh_connection_formated(rsocket_name), command])
-    return call(command)
+    return (remove_double_slashes(sub(SOURCE_DATA, f'{destination["data"]}/', source_file)),
+        remove_double_slashes(
+            sub(SOURCE_NAME_SPACE, f'{destination["name_space"]}/', source_link)))
+
+
+def batch_directories(batch: list, destination: dict) -> dict:
+    '''
+    Returns destination directories needed by batch
+    with the top (data or name space) they are created under
+    '''
+    batch_destination_directories: dict = {}
+    for source_link, source_file, _, _ in batch:
+        destination_file, destination_link = \
+            destination_paths(source_link, source_file, destination)
+        batch_destination_directories[path.dirname(destination_file)] = destination['data']
+        batch_destination_directories[path.dirname(destination_link)] = \
+            destination['name_space']
+    return batch_destination_directories
+
+
+def create_directories(batches: list,
+    destination: dict,
+    helper: Union[RemoteHelper, LocalHelper],
+    directories: dict,
+    journal: Union[DrainJournal, None] = None,
+    metrics: Union[DrainMetrics, None] = None) -> list:
+    '''
+    Creates and chowns destination directories of all batches in bulk
+    (up to DIRECTORY_CHUNK per helper request), returns batches which can be transferred,
+    directories['created'] is the cache of directories already created and chowned,
+    directories['failed'] collects directories which could not be created or chowned
+    '''
+    created: set = directories['created']
+    needed: dict = {}
+    for batch in batches:
+        needed.update(batch_directories(batch, destination))
+    to_create: list = sorted(set(needed) - created)
+    for chunk_start in range(0, len(to_create), DIRECTORY_CHUNK):
+        chunk: list = to_create[chunk_start:chunk_start + DIRECTORY_CHUNK]
+        # get all dest dirs up to d_ns and dest, each of them is chowned once
+        members: set = set()
+        for directory in chunk:
+            members.update(explode_path(directory, needed[directory]))
+        members -= created
+        mkdir_start: float = monotonic()
+        result: dict = helper.request('mkdir', paths=chunk, \
+            owner=FILE_OWNER_AND_GROUP, chown=sorted(members))
+        if metrics:
+            metrics.observe('mkdir', monotonic() - mkdir_start)
+        chunk_failed: set = set(result['failed'])
+        if not result['ok'] and not chunk_failed:
+            chunk_failed = set(chunk)
+        directories['failed'].update(chunk_failed)
+        created.update(members - chunk_failed)
+        created.update(set(chunk) - chunk_failed)
+    ready: list = []
+    for batch in batches:
+        batch_needed: set = set(batch_directories(batch, destination))
+        if batch_needed <= created:
+            ready.append(batch)
+        else:
+            print(f'Failed to create directories: {" ".join(sorted(batch_needed - created))}. '\
+                f'File: {batch[0][2]:>10_}: {path.dirname(batch[0][1])}')
+            if journal:
+                journal.record(FAILED_MKDIR, [batch_entry[:2] for batch_entry in batch])
+    return ready
+
+
+def kernel_copy(source_descriptor: int, destination_descriptor: int, size: int) -> None:
+    '''
+    Copies size bytes between descriptors in kernel,
+    copy_file_range where supported, sendfile otherwise
+    '''
+    use_copy_file_range: bool = hasattr(os, 'copy_file_range')
+    copied: int = 0
+    while copied < size:
+        if use_copy_file_range:
+            try:
+                chunk: int = os.copy_file_range(source_descriptor, destination_descriptor, \
+                    COPY_CHUNK)
+            except OSError:
+                # e.g. not supported between these filesystems, nothing was copied
+                use_copy_file_range = False
+                continue
+        else:
+            chunk = sendfile(destination_descriptor, source_descriptor, None, COPY_CHUNK)
+        if chunk == 0:
+            break
+        copied += chunk
+    if copied != size:
+        # e.g. the source was truncated meanwhile, the copy must not replace it
+        raise OSError(f'Copied {copied} of {size} bytes')
+
+
+def copy_file(source_file: str, destination_file: str) -> None:
+    '''
+    Copies file between filesystems with permissions, times and owner (like rsync -a),
+    the copy appears at destination_file atomically
+    '''
+    temporary_file: str = f'{destination_file}.xrd-drain-{SOURCE_ID}'
+    source_stat: stat_result = stat(source_file)
+    try:
+        with open(source_file, 'rb') as source_handle, \
+            open(temporary_file, 'wb') as destination_handle:
+            kernel_copy(source_handle.fileno(), destination_handle.fileno(), source_stat.st_size)
+        copystat(source_file, temporary_file)
+        chown(temporary_file, source_stat.st_uid, source_stat.st_gid)
+        rename(temporary_file, destination_file)
+    except OSError:
+        if path.lexists(temporary_file):
+            remove(temporary_file)
+        raise
+
+
+def local_transfer(source_directory: str,
+    destination_directory: str,
+    names: list) -> tuple:
+    '''
+    Local move replacement of rsync(), files are renamed when source and destination
+    share the filesystem and copied in kernel otherwise,
+    returns (names transferred, 0 when all of them were transferred)
+    '''
+    transferred: set = set()
+    try:
+        same_filesystem: bool = stat(source_directory).st_dev == stat(destination_directory).st_dev
+    except OSError as exception:
+        print(exception)
+        return (transferred, 1)
+    for name in names:
+        source_file: str = path.join(source_directory, name)
+        destination_file: str = path.join(destination_directory, name)
+        try:
+            if same_filesystem:
+                rename(source_file, destination_file)
+            else:
+                copy_file(source_file, destination_file)
+        except OSError as exception:
+            print(exception)
+            continue
+        transferred.add(name)
+    return (transferred, 0 if len(transferred) == len(names) else 1)
 
 
-def migrate(   # pylint: disable=too-many-branches,too-many-locals
-    source_link : str,
-    source_file: str,
+def rsync(source_directory: str,
+    destination_directory: str,
+    names: list,
+    destination: dict,
+    rsocket_name: str = '') -> tuple:
+    '''
+    Transfers files (names relative to source_directory) by one rsync call,
+    returns (names confirmed by rsync as transferred, rsync return code)
+    '''
+    target: str = remove_double_slashes(f'/{destination_directory}/')
+    command: list = ['/usr/bin/rsync', '-a', '--files-from=-', '--from0', '--out-format=%n']
+    if not destination['local']:
+        command += ['-e', ssh_connection_formated(destination, rsocket_name)]
+        target = f'{destination["server"]}:{target}'
+    result: CompletedProcess = run(command + [f'{source_directory}/', target], \
+        input=b'\x00'.join(fsencode(name) for name in names), stdout=PIPE, check=False)
+    if result.returncode == 0:
+        return (set(names), 0)
+    # Partial transfer, trust only the files rsync reported
+    return ({fsdecode(name) for name in result.stdout.split(b'\n')} & set(names), \
+        result.returncode)
+
+
+def migrate(   # pylint: disable=too-many-locals,too-many-branches
+    batch: list,
     multi_thread_tranfers: int,
-    migration_iolock: Lock,
-    worker_id: str) -> None:
-    '''
-    This migrates data and link to new destination
-    '''
-    # Create destination 'addresses'
-    destination_file: str = remove_double_slashes(
-        sub(SOURCE_DATA, f'{DESTINATION_DATA}/', source_file))
-    destination_link: str = remove_double_slashes(
-        sub(SOURCE_NAME_SPACE, f'{DESTINATION_NAME_SPACE}/', source_link))
-    rsync_command: list
-    if LOCAL_MOVE:
-        rsync_command = [remove_double_slashes(source_file), \
-            remove_double_slashes(f'/{destination_file}')]
-    else:
-        rsync_command = [remove_double_slashes(source_file), \
-            remove_double_slashes(f'{DESTINATION_SERVER}:/{destination_file}')]
-    destination_file_directory: str = path.dirname(destination_file)
-    destination_link_directory: str = path.dirname(destination_link)
-    # get all dest dirs up to d_ns and dest
-    destination_link_directory_members:str = ' '.join(
-        explode_path(destination_link_directory, DESTINATION_NAME_SPACE))
-    destination_file_directory_members: str = ' '.join(
-        explode_path(destination_file_directory, DESTINATION_DATA))
-    socket_name: str
-    # separate ssh socket for each worker
-    socket_name = f'{SOURCE_ID}-{worker_id}'
+    worker: dict) -> None:
+    '''
+    This migrates batch of data files from one directory and their links to new destination,
+    worker holds id, destination, iolock, helper, journal, controller, limiter and metrics
+    of the calling worker
+    '''
+    destination: dict = worker['destination']
+    migration_iolock: Lock = worker['iolock']
+    helper: Union[RemoteHelper, LocalHelper] = worker['helper']
+    journal: Union[DrainJournal, None] = worker['journal']
+    controller: AIMDController = worker['controller']
+    limiter: RateLimiter = worker['limiter']
+    metrics: DrainMetrics = worker['metrics']
+    source_directory: str = path.dirname(batch[0][1])
+    # Create destination 'addresses' of every link,
+    # a data file linked more than once belongs to its first link (the others fail)
+    destinations: dict = {}
+    owners: dict = {}
+    for source_link, source_file, _, source_size in batch:
+        destinations[source_link] = (source_link, source_file) \
+            + destination_paths(source_link, source_file, destination) + (source_size,)
+        owners.setdefault(path.basename(source_file), source_link)
+    destination_file_directory: str = path.dirname(next(iter(destinations.values()))[2])
     # Sleep during first 110% of mp_threads transfers up
     # to ~10 seconds not to overwhelm the destinations sshd
-    if multi_thread_tranfers \
+    # (the adaptive controller ramps the concurrency up itself)
+    if not ADAPTIVE and multi_thread_tranfers \
         < (MULTIPROCESS_THREADS + max((round(MULTIPROCESS_THREADS/10)), 1)):
         sleep(multi_thread_tranfers/(round(MULTIPROCESS_THREADS/10) + 1))
-    # create directory structure on destination
-    create_dir: str
-    if LOCAL_MOVE:
-        create_dir = ['/bin/mkdir', '-p', 'd_filedir']
-    else:
-        create_dir = flatten([ssh_connection(socket_name), DESTINATION_SERVER, \
-            f'/bin/mkdir -p {destination_file_directory} {destination_link_directory}'])
-    with migration_iolock:
-        print(f'Start migrating file {multi_thread_tranfers:>10_}: {source_link}')
-    if call(create_dir) == 0:
-        # Rsync data file
-        if rsync(rsync_command, socket_name) == 0:
-            # Create link on destination and set owner:group
-            link_cmd: str = f'/bin/ln -sf {destination_file} {destination_link} && '\
-                f'/bin/chown -h {FILE_OWNER_AND_GROUP} {destination_link} '\
-                    f'{destination_file_directory_members}  {destination_link_directory_members}'
-            create_link: list
-            if LOCAL_MOVE:
-                create_link = ['/bin/sh', '-c', link_cmd]
-            else:
-                create_link = flatten([ssh_connection(socket_name), DESTINATION_SERVER, \
-                    f'/bin/ln -sf {destination_file} {destination_link} '\
-                    f'&& /bin/chown -h {FILE_OWNER_AND_GROUP} {destination_link} '\
-                    f'{destination_file_directory_members} {destination_link_directory_members}'])
-            if call(create_link) == 0:
-                # Remove source data
-                if not LOCAL_MOVE:
-                    remove(source_link)
-                remove(source_file)
-                with migration_iolock:
-                    print(f'Done migrating file  {multi_thread_tranfers:>10_}: {source_link}')
-            else:
-                with migration_iolock:
-                    # Link failure
-                    print(f'Failed to create link {DESTINATION_SERVER}:{destination_link} or '\
-                        f'to set permissions! File: {multi_thread_tranfers:>10_}: {source_link}')
+    if not QUIET:
+        with migration_iolock:
+            print(f'Start migrating {len(batch):_} file(s) {multi_thread_tranfers:>10_}: '\
+                f'{source_directory}')
+    # Destination directories were created by create_directories()
+    limiter.acquire(len(owners), \
+        sum(destinations[source_link][4] for source_link in owners.values()))
+    # Rsync data files
+    transferred_names: set
+    rsync_code: int
+    with metrics.timed('rsync'):
+        if destination['local']:
+            transferred_names, rsync_code = local_transfer(source_directory, \
+                destination_file_directory, list(owners))
         else:
+            transferred_names, rsync_code = rsync(source_directory, \
+                destination_file_directory, list(owners), destination, worker['id'])
+    if rsync_code == SSH_FAILURE:
+        controller.count(failures=1)
+    # Links whose data file was transferred
+    transferred: set = {owners[name] for name in transferred_names}
+    if journal:
+        journal.record(FAILED_RSYNC, [destinations[link][:2] \
+            for link in sorted(set(destinations) - transferred)])
+    with migration_iolock:
+        for link in sorted(set(destinations) - transferred):
+            # Data failure
+            print(f'Failed to copy file: {destinations[link][1]} to: '\
+                f'{destination["server"]}:{destinations[link][2]}. File: '\
+                f'{multi_thread_tranfers:>10_}: {destinations[link][0]}')
+    if not transferred:
+        return
+    # Create links on destination and set owner:group
+    with metrics.timed('link'):
+        link_result: dict = helper.request('link', \
+            links=[destinations[link][2:4] for link in sorted(transferred)], \
+            owner=FILE_OWNER_AND_GROUP)
+    if 'error' in link_result:
+        controller.count(failures=1)
+    link_paths: set = {destinations[link][3] for link in transferred}
+    failed_links: set = set(link_result['failed'])
+    if not link_result['ok'] and not failed_links:
+        # Helper failed as a whole, no link can be trusted
+        failed_links = link_paths
+    migrated: list = []
+    migrated_bytes: int = 0
+    for link in sorted(transferred):
+        source_link, source_file, destination_file, destination_link, source_size = \
+            destinations[link]
+        if destination_link in failed_links:
+            if not path.lexists(source_file):
+                # Renamed by the local move, put it back for the old link
+                try:
+                    rename(destination_file, source_file)
+                except OSError as exception:
+                    with migration_iolock:
+                        print(f'Failed to move back {destination_file} to {source_file}: '\
+                            f'{exception}')
+            if journal:
+                journal.record(FAILED_LINK, [(source_link, source_file)])
             with migration_iolock:
-                # Data failure
-                print(f'Failed to copy file: {source_file} to: '\
-                    f'{DESTINATION_SERVER}:{destination_file}. File: '\
-                    f'{multi_thread_tranfers:>10_}: {source_link}')
-    else:
-        with migration_iolock:
-            print(f'Failed to create directories: {destination_file_directory} '\
-                f'and/or {destination_link_directory}. '\
-                f'File: {multi_thread_tranfers:>10_}: {source_link}')
+                # Link failure
+                print(f'Failed to create link {destination["server"]}:{destination_link} or '\
+                    f'to set permissions! File: {multi_thread_tranfers:>10_}: {source_link}')
+            continue
+        # Remove source data (the local move could have renamed it already)
+        if not destination['local']:
+            remove(source_link)
+        if path.lexists(source_file):
+            remove(source_file)
+        migrated.append((source_link, source_file))
+        migrated_bytes += source_size
+        if not QUIET:
+            with migration_iolock:
+                print(f'Done migrating file  {multi_thread_tranfers:>10_}: {source_link}')
+    if journal:
+        journal.record(DONE, migrated)
+    controller.count(len(migrated), migrated_bytes)
 
 
-def multithreaded_processing(multithread_queue: Queue, multithread_iolock: Lock) -> None:
+def multithreaded_processing(multithread_queue: Queue,
+    multithread_iolock: Lock,
+    controller: AIMDController,
+    limiter: RateLimiter,
+    metrics: DrainMetrics,
+    destination: dict) -> None:
     '''
-    Multithreaded processing
+    Multithreaded processing of one destination, workers above the controller limit wait
     '''
     worker_id: str = f"{int(current_process().name.split('-')[1]):0>4}"
-    multithreaded_link: str | None
-    multithreaded_file: str | None
-    multithreaded_number: int | None
-    while True:
-        multithreaded_link, multithreaded_file, multithreaded_number = multithread_queue.get()
-        if None in [multithreaded_link, multithreaded_file, multithreaded_number]:
-            break
-        migrate(multithreaded_link, multithreaded_file, \
-            multithreaded_number, multithread_iolock, worker_id)
+    # One persistent helper per worker for mkdir/ln/chown,
+    # it holds the ControlMaster of the worker socket rsync also uses
+    helper: Union[RemoteHelper, LocalHelper] = destination_helper(destination, worker_id)
+    journal: Union[DrainJournal, None] = None
+    if JOURNAL_FILE:
+        journal = DrainJournal(JOURNAL_FILE)
+    worker: dict = {
+        'id': worker_id,
+        'destination': destination,
+        'iolock': multithread_iolock,
+        'helper': helper,
+        'journal': journal,
+        'controller': controller,
+        'limiter': limiter,
+        'metrics': metrics,
+    }
+    multithreaded_batch: list | None
+    # Replacements of died workers get the freed slots
+    slot: int = controller.take_slot()
+    try:
+        while True:
+            controller.wait_for_turn(slot)
+            multithreaded_batch = multithread_queue.get()
+            if multithreaded_batch is None:
+                break
+            with metrics.working():
+                migrate(multithreaded_batch, multithreaded_batch[0][2], worker)
+    finally:
+        controller.free_slot(slot)
+        helper.close()
+        if journal:
+            journal.close()
 
 
 def clean_empty_dirs(directory_to_clean: str) -> None:
@@ -246,162 +615,342 @@ def clean_empty_dirs(directory_to_clean: str) -> None:
     call(['/bin/find', directory_to_clean, '-mindepth', '1', '-type', 'd', '-empty', '-delete'])
 
 
-def walk(top: str,
-    threads: int = MULTIPROCESS_THREADS,
-    separate_links: bool = True,
-    full_paths: bool = True):
+def start_lane(destination: dict,
+    io_lock: Lock,
+    limiter: RateLimiter,
+    metrics: DrainMetrics,
+    controller_stop: Event) -> dict:
     '''
-    Multi-threaded version of os.walk() with some improvements
+    Starts pool of workers (with its own queue, controller and helpers) for one destination
     '''
-    if not path.isdir(top):
+    lane: dict = {
+        'destination': destination,
+        # Full queue pauses the walk
+        'queue': Queue(MULTIPROCESS_THREADS * QUEUED_BATCHES),
+        'controller': AIMDController(MULTIPROCESS_THREADS, \
+            initial=0 if ADAPTIVE else MULTIPROCESS_THREADS),
+        'scheduler': SizeScheduler(ORDER),
+        'directories': {'created': set(), 'failed': set()},
+        # source data directory: [[(link, file, number, size), ...], bytes], oldest first
+        'batches': {},
+        'ready': [],
+        'space': 0,
+    }
+    # The pool lives until stop_lane() closes and joins it
+    lane['pool'] = Pool(  # pylint: disable=consider-using-with
+        MULTIPROCESS_THREADS, initializer=multithreaded_processing, \
+        initargs=(lane['queue'], io_lock, lane['controller'], limiter, metrics, destination))
+    lane['helper'] = destination_helper(destination)
+    lane['load_helper'] = destination_helper(destination)
+    lane['controller_thread'] = Thread(target=lane['controller'].run, args=(controller_stop, \
+        lambda: lane['load_helper'].request('load').get('load'), \
+        lambda old, new, bytes_rate, files_rate, load: print(
+            f'{destination["server"]}:{destination["data"]}: active threads {old} -> {new} '\
+            f'({bytes_rate / 1e6:.1f} MB/s, {files_rate:.1f} files/s, '\
+            f'destination load {load})')), \
+        name=f'drain controller {destination["server"]}', daemon=True)
+    if ADAPTIVE:
+        lane['controller_thread'].start()
+    return lane
+
+
+def stop_lane(lane: dict) -> None:
+    '''
+    Lets the workers of the lane finish (controller_stop must be set already)
+    '''
+    if ADAPTIVE:
+        lane['controller_thread'].join()
+    lane['controller'].release()
+    for _ in range(MULTIPROCESS_THREADS):
+        lane['queue'].put(None)
+    lane['pool'].close()
+    lane['pool'].join()
+    lane['helper'].close()
+    lane['load_helper'].close()
+
+
+def rendezvous_score(destination: dict, key: str) -> float:
+    '''
+    Weighted rendezvous (highest random weight) hash score of key on destination,
+    adding or removing destinations moves only the keys of that destination
+    '''
+    digest: int = int(md5(f'{destination["server"]}:{destination["data"]}\x00{key}' \
+        .encode('utf-8', 'surrogateescape')).hexdigest()[:16], 16)
+    # Uniform in (0, 1)
+    return -destination['weight'] / log((digest + 1) / ((1 << 64) + 1))
+
+
+def open_journal() -> tuple:
+    '''
+    Returns (DrainJournal or None, PathStore of migrated links, {failed link: file})
+    of --journal (and --resume)
+    '''
+    journal_done: PathStore = PathStore()
+    journal_failed: dict = {}
+    if not JOURNAL_FILE:
+        return (None, journal_done, journal_failed)
+    if RESUME:
+        journal_done, journal_failed = load_journal(JOURNAL_FILE)
+        print(f'Journal {JOURNAL_FILE}: {len(journal_done):_} files already migrated, '\
+            f'{len(journal_failed):_} failed files will be retried first')
+    # Must exist (and be truncated) before the workers open it
+    return (DrainJournal(JOURNAL_FILE, not RESUME), journal_done, journal_failed)
+
+
+def place(migration: dict, place_file: str, place_size: int) -> dict:
+    '''
+    Picks destination lane of file
+    '''
+    lanes: list = migration['lanes']
+    if len(lanes) == 1:
+        return lanes[0]
+    if PLACEMENT == 'hash':
+        place_key: str = sub(SOURCE_DATA, '', place_file)
+        return max(lanes, key=lambda lane: rendezvous_score(lane['destination'], place_key))
+    if monotonic() - migration['space_checked'] > SPACE_INTERVAL:
+        migration['space_checked'] = monotonic()
+        for lane in lanes:
+            lane['space'] = lane['helper'].request('space', \
+                path=lane['destination']['data']).get('space', 0)
+    chosen: dict = max(lanes, key=lambda lane: lane['space'] * lane['destination']['weight'])
+    # Expected space until the next check
+    chosen['space'] -= place_size
+    return chosen
+
+
+def release_batches(lane: dict, flush: bool = False) -> None:
+    '''
+    Moves scheduled batches to the workers, blocks when the window is full
+    '''
+    while len(lane['scheduler']) and \
+        (flush or lane['scheduler'].full() or not lane['queue'].full()):
+        lane['queue'].put(lane['scheduler'].pop())
+
+
+def dispatch(migration: dict, lane: dict, flush: bool = False) -> None:
+    '''
+    Schedules ready batches, partial batches are sent when workers run dry
+    '''
+    starving: bool = \
+        lane['queue'].qsize() + len(lane['scheduler']) < MULTIPROCESS_THREADS
+    while lane['batches'] and (flush or starving or len(lane['batches']) > PENDING_BATCHES):
+        oldest: str = next(iter(lane['batches']))
+        lane['ready'].append(lane['batches'].pop(oldest)[0])
+        starving = False
+    if lane['ready'] and (flush or starving or len(lane['ready']) >= READY_BATCHES):
+        for ready_batch in create_directories(lane['ready'], lane['destination'], \
+            lane['helper'], lane['directories'], migration['journal'], migration['metrics']):
+            lane['scheduler'].add(sum(ready_entry[3] for ready_entry in ready_batch), \
+                ready_batch)
+        lane['ready'] = []
+    release_batches(lane, flush)
+
+
+def queue_file(migration: dict, queue_link: str, queue_target: str) -> None:
+    '''
+    Collects files of one data directory and destination into batches
+    '''
+    try:
+        queue_size: int = stat(queue_target).st_size
+    except OSError:
+        migration['illegals'].add(queue_link)
         return
-    lock: Lock = tLock()
-    on_input: Condition = Condition(lock)
-    on_output: Condition = Condition(lock)
-    state: dict = {'tasks': 1}
-    paths: set = {top}
-    output: list = []
-
-    def worker() -> None:
-        while True:
-            with lock:
-                while True:
-                    if not state['tasks']:
-                        output.append(None)
-                        on_output.notify()
-                        return
-                    if not paths:
-                        on_input.wait()
-                        continue
-                    fs_path: str = paths.pop()
-                    break
-            try:
-                walk_dirs: set = set()
-                walk_files: set = set()
-                walk_links: set = set()
-                for item in scandir(fs_path):
-                    item_name: str = item.name
-                    if full_paths:
-                        item_name = item.path
-                    if item.is_symlink():
-                        if separate_links:
-                            walk_links.add(item_name)
-                        else:
-                            walk_files.add(item_name)
-                    elif item.is_file():
-                        walk_files.add(item_name)
-                    else:
-                        walk_dirs.add(item_name)
-                        with lock:
-                            state['tasks'] += 1
-                            paths.add(item.path)
-                            on_input.notify()
-                with lock:
-                    if separate_links:
-                        output.append((fs_path, walk_dirs, walk_files, walk_links))
-                    else:
-                        output.append((fs_path, walk_dirs, walk_files))
-                    on_output.notify()
-            except OSError as exception:
-                print(exception, file=stderr)
-            finally:
-                with lock:
-                    state['tasks'] -= 1
-                    if not state['tasks']:
-                        on_input.notify_all()
-
-    workers: list = [Thread(target=worker, name=f'fastio.walk {i} {top}') for i in range(threads)]
-    for start_worker in workers:
-        start_worker.start()
-    while threads or output:
-        with lock:
-            while not output:
-                on_output.wait()
-            item: tuple = output.pop()
-        if item:
-            yield item
-        else:
-            threads -= 1
+    lane: dict = place(migration, queue_target, queue_size)
+    batch: list = lane['batches'].setdefault(path.dirname(queue_target), [[], 0])
+    batch[0].append((queue_link, queue_target, migration['iterator'], queue_size))
+    batch[1] += queue_size
+    migration['iterator'] += 1
+    migration['found_files'] += 1
+    migration['found_bytes'] += queue_size
+    if len(batch[0]) >= BATCH_FILES or (BATCH_BYTES and batch[1] >= BATCH_BYTES):
+        lane['ready'].append(batch[0])
+        del lane['batches'][path.dirname(queue_target)]
+    dispatch(migration, lane)
 
 
+def collect(migration: dict) -> dict:
+    '''
+    Snapshot of the progress for xrd_metrics
+    '''
+    metrics: DrainMetrics = migration['metrics']
+    snapshot: dict = {
+        'found_files': migration['found_files'],
+        'found_bytes': migration['found_bytes'],
+        'scanning': migration['scanning'],
+        'busy': metrics.busy.value,
+        'workers': MULTIPROCESS_THREADS * len(migration['lanes']),
+        'elapsed': monotonic() - metrics.started,
+        'lanes': [],
+    }
+    for lane in migration['lanes']:
+        with lane['controller'].counters.get_lock():
+            counters: list = lane['controller'].counters[:]
+        snapshot['lanes'].append({
+            'name': f'{lane["destination"]["server"]}:{lane["destination"]["data"]}',
+            'queued': lane['queue'].qsize() + len(lane['scheduler']),
+            'active': lane['controller'].limit.value,
+            'files': counters[FILES],
+            'bytes': counters[BYTES],
+            'failures': counters[FAILURES],
+        })
+    for counter in ['files', 'bytes', 'failures']:
+        snapshot[counter] = sum(lane[counter] for lane in snapshot['lanes'])
+    return snapshot
+
+
+def start_reporting(migration: dict) -> None:
+    '''
+    Starts the status line thread and the metrics endpoint (when they are enabled)
+    '''
+    migration['status_thread'] = Thread(target=report_status, \
+        args=(migration['status_stop'], lambda: collect(migration), migration['metrics'], \
+        print, STATUS_SECONDS), name='drain status', daemon=True)
+    if STATUS_SECONDS:
+        migration['status_thread'].start()
+    migration['metrics_server'] = None
+    if METRICS_OPTION:
+        try:
+            migration['metrics_server'] = serve_metrics(METRICS_ADDRESS, \
+                int(METRICS_OPTION.rsplit(':', 1)[-1]), lambda: collect(migration), \
+                migration['metrics'])
+        except OSError as exception:
+            print(f'Metrics endpoint {METRICS_OPTION} not started: {exception}')
+
+
+def stop_reporting(migration: dict) -> None:
+    '''
+    Prints the final status line and stops the reporting (after all transfers finished)
+    '''
+    migration['status_stop'].set()
+    if STATUS_SECONDS:
+        migration['status_thread'].join()
+        print(status_line(collect(migration), None, migration['metrics']))
+    if migration['metrics_server']:
+        migration['metrics_server'].shutdown()
+
+
+def queue_name_space(migration: dict,
+    name_space: str,
+    data_dir: str,
+    journal_done: PathStore,
+    journal_failed: dict) -> None:
+    '''
+    Queues files which failed last time first, then the targets of all links
+    in the name space not migrated yet, files and dangling links are illegal entries
+    '''
+    retried: set = set()
+    for failed_link, failed_file in journal_failed.items():
+        if path.islink(failed_link) and match(data_dir, failed_file) \
+            and path.isfile(failed_file):
+            queue_file(migration, failed_link, failed_file)
+            retried.add(failed_link)
+    for flushed_lane in migration['lanes']:
+        dispatch(migration, flushed_lane, True)
+    # Stream all valid links and corresponding files to the workers
+    for ns_entry in scan(name_space, MULTIPROCESS_THREADS, stats=migration['scan_stats'], \
+        index=migration['scan_index'], resolve_links=True):
+        if ns_entry.kind == FILE:
+            migration['illegals'].add(ns_entry.path)
+            continue
+        if ns_entry.kind != LINK:
+            continue
+        ns_path: str = ns_entry.path
+        if ns_path in journal_done or ns_path in retried:
+            continue
+        if not ns_entry.target:
+            # Link vanished, is unreadable or dangling (into data_dir)
+            dangling_target: str = link_target(ns_path)
+            if not dangling_target or match(data_dir, dangling_target):
+                migration['illegals'].add(ns_path)
+        elif match(data_dir, ns_entry.target):
+            queue_file(migration, ns_path, ns_entry.target)
+    migration['scanning'] = False
+    for flushed_lane in migration['lanes']:
+        dispatch(migration, flushed_lane, True)
+
+
+def report_migration(migration: dict) -> None:
+    '''
+    Prints statistics of the finished migration
+    '''
+    scan_index: Union[ScanIndex, None] = migration['scan_index']
+    scan_stats: dict = migration['scan_stats']
+    if scan_index:
+        print(f'Index {INDEX_FILE}: reused {scan_index.stats["reused"]:_} directories, '\
+            f'rescanned {scan_index.stats["rescanned"]:_}')
+    print(f'Scanner was paused {scan_stats.get("stalls", 0):_} times '\
+        f'({scan_stats.get("stall_time", 0.0):.1f}s) waiting for processing')
+    for finished_lane in migration['lanes']:
+        print(f'{finished_lane["destination"]["server"]}:{finished_lane["destination"]["data"]}: '\
+            'created '\
+            f'{len(finished_lane["directories"]["created"]):_} destination directories, '\
+            f'{len(finished_lane["directories"]["failed"]):_} could not be created or chowned')
+
 
 def start_migration(name_space: str, data_dir: str) -> set:
     '''
-    Does the MT migration
+    Does the MT migration, the name space walk, link resolving
+    and transfers to all destinations run at the same time connected by bounded queues
     '''
-    migrate_lock: tLock = tLock()
-    migrate_on_input: Condition = Condition(migrate_lock)
-    migrate_on_output: Condition = Condition(migrate_lock)
-    migrate_event: Event = Event()
-    migrate_state: dict = {
+    journal_done: PathStore
+    journal_failed: dict
+    journal, journal_done, journal_failed = open_journal()
+    # Set up the multiprocess pool and queue of every destination
+    io_lock: Lock = Lock()
+    controller_stop: Event = Event()
+    limiter: RateLimiter = RateLimiter()
+    migration: dict = {
         'iterator': 1,
         'illegals': set(),
-        'links_to_process': set(),
+        'space_checked': 0.0,
+        'found_files': 0,
+        'found_bytes': 0,
+        'scanning': True,
+        'journal': journal,
+        'metrics': DrainMetrics(),
+        'status_stop': Event(),
+        'scan_stats': {},
+        'scan_index': None,
     }
-    # Find all valid links and corresponding files
-    for _, _, files, links in walk(name_space):
-        for filename in files:
-            migrate_state['illegals'].add(filename)
-        for ns_link in links:
-            migrate_state['links_to_process'].add(ns_link)
-    # Set up the multiprocess pool and queue
-    mt_queue: Queue = Queue()
-    io_lock: Lock = Lock()
-    pool: Pool = Pool(MULTIPROCESS_THREADS, initializer=multithreaded_processing, \
-        initargs=(mt_queue, io_lock))  # pylint: disable=consider-using-with
-
-    def link_worker() -> None:
-        while True:
-            with migrate_lock:
-                while True:
-                    if len(migrate_state['links_to_process']) == 0:
-                        migrate_on_output.notify()
-                        return
-                    migrate_path: str = migrate_state['links_to_process'].pop()
-                    break
-            try:
-                migrate_target: str = readlink(migrate_path)
-                if not path.isabs(migrate_target):
-                    # Create absolute link address
-                    migrate_target = path.abspath(
-                        path.join(path.dirname(migrate_path), migrate_target))
-                if match(data_dir, migrate_target):
-                    with migrate_lock:
-                        if not path.exists(migrate_target):
-                            migrate_state['illegals'].add(migrate_path)
-                        else:
-                            mt_queue.put((migrate_path, migrate_target, migrate_state['iterator']))
-                            migrate_state['iterator'] += 1
-            except FileNotFoundError:
-                migrate_state['illegals'].add(migrate_path)
-
-            if len(migrate_state['links_to_process']) == 0:
-                migrate_on_input.notify_all()
-            if migrate_event.is_set():
-                migrate_on_input.notify_all()
-                break
-
-
-    migrate_workers: list = [Thread(target=link_worker, \
-        name=f'link_worker {i} {data_dir}') for i in range(MULTIPROCESS_THREADS)]
+    migration['lanes'] = [start_lane(destination, io_lock, limiter, migration['metrics'], \
+        controller_stop) for destination in DESTINATIONS]
+    limits_reload: Event = Event()
+    limiter_thread: Thread = Thread(target=limiter.run, \
+        args=(controller_stop, LIMITS_FILE, limits_reload, lambda limits: print(
+            f'Limits {LIMITS_FILE}: {limits[0] / (1 << 20):.1f} MiB/s, {limits[1]:.1f} files/s '\
+            '(0 is unlimited)' if isinstance(limits, tuple) else f'Limits ignored: {limits}')), \
+        name='drain limiter', daemon=True)
+    if LIMITS_FILE:
+        # Workers are forked already, only the main process reloads the limits
+        signal(SIGHUP, lambda *_: limits_reload.set())
+        limiter_thread.start()
+    # Reports until all transfers are finished
+    start_reporting(migration)
     try:
-        for migrate_start_worker in migrate_workers:
-            migrate_start_worker.start()
+        if INDEX_FILE:
+            migration['scan_index'] = ScanIndex(INDEX_FILE)
+        queue_name_space(migration, name_space, data_dir, journal_done, journal_failed)
     except KeyboardInterrupt:
-        migrate_event.set()
-        for migrate_start_worker in migrate_workers:
-            migrate_start_worker.join()
-        while not mt_queue.empty():
-            mt_queue.get()
-    else:
-        for migrate_start_worker in migrate_workers:
-            migrate_start_worker.join()
-    for _ in range(MULTIPROCESS_THREADS):
-        mt_queue.put((None, None, None))
-    pool.close()
-    pool.join()
-
-    return migrate_state['illegals']
+        print('Interrupted, waiting for running transfers to finish')
+        for interrupted_lane in migration['lanes']:
+            while True:
+                try:
+                    interrupted_lane['queue'].get_nowait()
+                except Empty:
+                    break
+    finally:
+        if migration['scan_index']:
+            migration['scan_index'].close()
+        controller_stop.set()
+        if LIMITS_FILE:
+            limiter_thread.join()
+        for stopped_lane in migration['lanes']:
+            stop_lane(stopped_lane)
+        stop_reporting(migration)
+        if journal:
+            journal.close()
+    report_migration(migration)
+    return migration['illegals']
 
 
 if __name__ == '__main__':
@@ -416,19 +965,28 @@ if __name__ == '__main__':
     else:
         check_if_directory_exists(SOURCE_DATA)
 
-    TEST_FILE: str = f'/.xrd-drain-testfile_55c4e792761ddeb2dc{SOURCE_ID}'
-    TEST_FILE = [f'{DESTINATION_NAME_SPACE}{TEST_FILE}', f'{DESTINATION_DATA}{TEST_FILE}']
-    for test_destination in TEST_FILE:
-        check_command: str = f'/bin/touch {test_destination} && /bin/chown {FILE_OWNER_AND_GROUP} '\
-            f'{test_destination} && /bin/rm -f {test_destination}'
-        if LOCAL_MOVE:
-            check: list = ['/bin/sh', '-c', check_command]
-        else:
-            check = flatten([ssh_connection(), DESTINATION_SERVER, check_command])
-        RETURN_CODE: int = call(check)
-        if RETURN_CODE != 0:
-            exit(f'Writing of test files to {DESTINATION_NAME_SPACE} and {DESTINATION_DATA} '\
-                f'failed!\n Is {FILE_OWNER_AND_GROUP} defined on {DESTINATION_SERVER}?')
+    for test_server in DESTINATIONS:
+        TEST_FILE: str = f'/.xrd-drain-testfile_55c4e792761ddeb2dc{SOURCE_ID}'
+        TEST_FILE = [f'{test_server["name_space"]}{TEST_FILE}', f'{test_server["data"]}{TEST_FILE}']
+        for test_destination in TEST_FILE:
+            check_command: str = f'/bin/touch {test_destination} && '\
+                f'/bin/chown {FILE_OWNER_AND_GROUP} {test_destination} && '\
+                f'/bin/rm -f {test_destination}'
+            if test_server['local']:
+                check: list = ['/bin/sh', '-c', check_command]
+            else:
+                check = flatten([ssh_connection(test_server), test_server['server'], check_command])
+            RETURN_CODE: int = call(check)
+            if RETURN_CODE != 0:
+                exit(f'Writing of test files to {test_server["name_space"]} and '\
+                    f'{test_server["data"]} failed!\n Is {FILE_OWNER_AND_GROUP} defined on '\
+                    f'{test_server["server"]}?')
+        # The local move runs the helper operations in process, the check still covers
+        # the bootstrap of the helper
+        HELPER_ERROR: str = check_helper([] if test_server['local'] else \
+            ssh_connection(test_server) + [test_server['server']], test_server['data'])
+        if HELPER_ERROR:
+            exit(f'Helper on {test_server["server"]} does not work: {HELPER_ERROR}')
 
     ILLEGAL_ENTRIES_IN_SOURCE_NAME_SPACE = start_migration(SOURCE_NAME_SPACE, SOURCE_DATA)
     print('Data migration done')
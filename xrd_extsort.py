@@ -0,0 +1,161 @@
+#!/usr/bin/python3
+# vim: set fileencoding=utf-8 :
+# Version 1.0.0
+'''
+External merge sort of path records with bounded memory.
+Records (strings or tuples of strings) are collected into runs,
+every full run is sorted and written NUL separated to a temporary file,
+sorted() streams the k-way merge of all runs.
+RecordSpool keeps records in a NUL separated temporary file in the order they were added.
+'''
+from heapq import merge
+from os import path, remove
+from shutil import rmtree
+from tempfile import gettempdir, mkdtemp, mkstemp
+from typing import Generator, TextIO, Union
+
+RUN_SIZE: int = 1_000_000
+CHUNK_SIZE: int = 1 << 20
+ENCODING: dict = {'encoding': 'utf-8', 'errors': 'surrogateescape', 'newline': ''}
+MODULE_FILE: str = path.abspath(__file__)
+
+
+def read_records(handle: TextIO, fields: int = 1, chunk_size: int = CHUNK_SIZE) -> Generator:
+    '''
+    Reads NUL terminated records in fixed size chunks,
+    yields strings (fields == 1) or tuples of fields strings,
+    a torn record at the end (without its terminating NUL) is dropped
+    '''
+    rest: str = ''
+    pending: list = []
+    while True:
+        chunk: str = handle.read(chunk_size)
+        if not chunk:
+            break
+        parts: list = (rest + chunk).split('\x00')
+        rest = parts.pop()
+        if fields == 1:
+            yield from parts
+        else:
+            pending.extend(parts)
+            complete: int = len(pending) - len(pending) % fields
+            for record in range(0, complete, fields):
+                yield tuple(pending[record:record + fields])
+            del pending[:complete]
+
+
+class ExternalSorter:
+    '''
+    Collects records and returns them sorted, spilling runs to disk
+    '''
+    def __init__(self,
+        directory: str = '',
+        run_size: int = RUN_SIZE,
+        fields: int = 1) -> None:
+        self.directory: str = mkdtemp(prefix='xrd-sort-', dir=directory or gettempdir())
+        self.run_size: int = run_size
+        self.fields: int = fields
+        self.records: list = []
+        self.runs: list = []
+        self.count: int = 0
+
+    def add(self, record: Union[str, tuple]) -> None:
+        '''
+        Adds one record, writes a run when run_size records are collected
+        '''
+        self.records.append(record)
+        self.count += 1
+        if len(self.records) >= self.run_size:
+            self.write_run()
+
+    def write_run(self) -> None:
+        '''
+        Sorts collected records and writes them as new run
+        '''
+        if not self.records:
+            return
+        self.records.sort()
+        run_file: str = f'{self.directory}/run-{len(self.runs):06}'
+        with open(run_file, 'w', **ENCODING) as run_handle:
+            if self.fields == 1:
+                run_handle.write('\x00'.join(self.records))
+            else:
+                run_handle.write('\x00'.join(field for record in self.records \
+                    for field in record))
+            run_handle.write('\x00')
+        self.runs.append(run_file)
+        self.records = []
+
+    def read_run(self, run_file: str) -> Generator:
+        '''
+        Streams records of one run
+        '''
+        with open(run_file, 'r', **ENCODING) as run_handle:
+            yield from read_records(run_handle, self.fields)
+
+    def sorted(self) -> Generator:
+        '''
+        Streams all records in sorted order
+        '''
+        if not self.runs:
+            self.records.sort()
+            yield from self.records
+            return
+        self.write_run()
+        yield from merge(*[self.read_run(run_file) for run_file in self.runs])
+
+    def close(self) -> None:
+        '''
+        Removes all runs
+        '''
+        self.records = []
+        self.runs = []
+        rmtree(self.directory, ignore_errors=True)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __enter__(self) -> 'ExternalSorter':
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+
+class RecordSpool:
+    '''
+    Collects string records on disk and streams them back unsorted
+    '''
+    def __init__(self, directory: str = '') -> None:
+        descriptor, self.file = mkstemp(prefix='xrd-spool-', dir=directory or gettempdir())
+        self.handle: TextIO = open(descriptor, 'w', \
+            **ENCODING)  # pylint: disable=consider-using-with
+        self.count: int = 0
+
+    def add(self, record: str) -> None:
+        '''
+        Appends one record
+        '''
+        self.handle.write(f'{record}\x00')
+        self.count += 1
+
+    def records(self) -> Generator:
+        '''
+        Streams all records in the order they were added
+        '''
+        self.handle.flush()
+        with open(self.file, 'r', **ENCODING) as spool_handle:
+            yield from read_records(spool_handle)
+
+    def close(self) -> None:
+        '''
+        Removes the spool file
+        '''
+        self.handle.close()
+        try:
+            remove(self.file)
+        except FileNotFoundError:
+            pass
+
+    def __len__(self) -> int:
+        return self.count
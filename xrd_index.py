@@ -0,0 +1,137 @@
+#!/usr/bin/python3
+# vim: set fileencoding=utf-8 :
+# Version 1.0.0
+'''
+Persistent index of scanned directories (SQLite).
+For every directory it keeps its mtime, entries and link targets,
+scan() reuses the stored listing of a directory whose mtime did not change
+and skips the readdir and readlink calls for it.
+'''
+from os import path
+from sqlite3 import Connection, connect
+from threading import Lock
+from time import time
+from typing import Union
+
+COMMIT_EVERY: int = 1_000
+MODULE_FILE: str = path.abspath(__file__)
+# Listings younger than this could still change within the same mtime tick
+RACY_WINDOW: int = 2_000_000_000
+SCHEMA: str = '''
+CREATE TABLE IF NOT EXISTS directories (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    mtime INTEGER NOT NULL,
+    seen INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    directory INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    kind INTEGER NOT NULL,
+    target TEXT,
+    PRIMARY KEY (directory, name)
+);
+'''
+
+
+class ScanIndex:
+    '''
+    Directory listing cache shared by all scanner threads
+    '''
+    def __init__(self, index_file: str) -> None:
+        self.connection: Connection = connect(index_file, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+        self.lock: Lock = Lock()
+        self.run: int = self.connection.execute(
+            'SELECT COALESCE(MAX(seen), 0) + 1 FROM directories').fetchone()[0]
+        self.uncommitted: int = 0
+        self.stats: dict = {'reused': 0, 'rescanned': 0}
+
+    def commit(self, force: bool = False) -> None:
+        '''
+        Commits every COMMIT_EVERY changes (call with lock held)
+        '''
+        self.uncommitted += 1
+        if force or self.uncommitted >= COMMIT_EVERY:
+            self.connection.commit()
+            self.uncommitted = 0
+
+    def lookup(self, directory: str, mtime: int) -> Union[list, None]:
+        '''
+        Returns stored [(name, kind, target), ...] of directory,
+        or None when the directory is unknown or its mtime changed
+        '''
+        with self.lock:
+            row: Union[tuple, None] = self.connection.execute(
+                'SELECT id, mtime FROM directories WHERE path = ?', (directory,)).fetchone()
+            if row is None or row[1] != mtime:
+                self.stats['rescanned'] += 1
+                return None
+            self.connection.execute('UPDATE directories SET seen = ? WHERE id = ?', \
+                (self.run, row[0]))
+            self.commit()
+            self.stats['reused'] += 1
+            return self.connection.execute(
+                'SELECT name, kind, target FROM entries WHERE directory = ?', \
+                (row[0],)).fetchall()
+
+    def store(self, directory: str, mtime: int, listing: list) -> None:
+        '''
+        Replaces stored listing [(name, kind, target), ...] of directory
+        '''
+        try:
+            for name, _, target in listing:
+                name.encode('utf-8')
+                if target:
+                    target.encode('utf-8')
+        except UnicodeEncodeError:
+            # Undecodable file names can not be stored, always rescan
+            return
+        if int(time() * 1e9) - mtime < RACY_WINDOW:
+            # Force rescan next time, the directory may still be changing
+            mtime = -1
+        with self.lock:
+            # No UPSERT, old sqlite (CentOS 7) has to work too
+            row: Union[tuple, None] = self.connection.execute(
+                'SELECT id FROM directories WHERE path = ?', (directory,)).fetchone()
+            if row is None:
+                directory_id: int = self.connection.execute(
+                    'INSERT INTO directories (path, mtime, seen) VALUES (?, ?, ?)', \
+                    (directory, mtime, self.run)).lastrowid
+            else:
+                directory_id = row[0]
+                self.connection.execute(
+                    'UPDATE directories SET mtime = ?, seen = ? WHERE id = ?', \
+                    (mtime, self.run, directory_id))
+                self.connection.execute('DELETE FROM entries WHERE directory = ?', \
+                    (directory_id,))
+            self.connection.executemany(
+                'INSERT INTO entries (directory, name, kind, target) VALUES (?, ?, ?, ?)', \
+                [(directory_id, name, kind, target) for name, kind, target in listing])
+            self.commit()
+
+    def finish(self, top: str) -> None:
+        '''
+        Forgets directories below top which were not seen by the finished scan
+        '''
+        top = top.rstrip('/')
+        # All paths below top sort between "top/" and "top0" ("0" follows "/")
+        below_top: tuple = ('(path = ? OR (path >= ? AND path < ?)) AND seen < ?', \
+            (top, f'{top}/', f'{top}0', self.run))
+        with self.lock:
+            self.connection.execute(
+                f'DELETE FROM entries WHERE directory IN '\
+                f'(SELECT id FROM directories WHERE {below_top[0]})', below_top[1])
+            self.connection.execute(f'DELETE FROM directories WHERE {below_top[0]}', \
+                below_top[1])
+            self.commit(True)
+
+    def close(self) -> None:
+        '''
+        Commits and closes the index
+        '''
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
@@ -0,0 +1,75 @@
+#!/usr/bin/python3
+# vim: set fileencoding=utf-8 :
+# Version 1.0.0
+'''
+Append-only journal of migrated files for resumable drains.
+Every record is "state NUL link NUL file NUL", records of one batch are written
+by a single write() to the file opened with O_APPEND and synced before
+the next step, so records of concurrent workers never interleave.
+The last record of a link wins when the journal is loaded.
+'''
+from os import O_APPEND, O_CREAT, O_WRONLY, close, fsencode, fsync, open as os_open, write
+from typing import Union
+from xrd_extsort import read_records, ENCODING
+from xrd_pathstore import PathStore
+
+DONE: str = 'done'
+FAILED_MKDIR: str = 'failed-mkdir'
+FAILED_RSYNC: str = 'failed-rsync'
+FAILED_LINK: str = 'failed-link'
+FIELDS: int = 3
+
+
+def load_journal(journal_file: str) -> tuple:
+    '''
+    Returns (PathStore of done links, {failed link: file} in journal order),
+    a torn record left by a crash is cut off so new records can be appended
+    '''
+    done: PathStore = PathStore()
+    failed: dict = {}
+    complete: int = 0
+    try:
+        with open(journal_file, 'r', **ENCODING) as journal_handle:
+            for state, link, link_file in read_records(journal_handle, FIELDS):
+                complete += len(fsencode(f'{state}\x00{link}\x00{link_file}\x00'))
+                if state == DONE:
+                    done.add(link)
+                    failed.pop(link, None)
+                else:
+                    failed.pop(link, None)
+                    failed[link] = link_file
+    except FileNotFoundError:
+        return (done, failed)
+    with open(journal_file, 'r+b') as journal_handle:
+        journal_handle.truncate(complete)
+    return (done, failed)
+
+
+class DrainJournal:
+    '''
+    Appending side of the journal, one instance per process
+    '''
+    def __init__(self, journal_file: str, truncate: bool = False) -> None:
+        if truncate:
+            with open(journal_file, 'wb'):
+                pass
+        self.descriptor: Union[int, None] = os_open(journal_file, O_WRONLY | O_APPEND | O_CREAT, \
+            0o600)
+
+    def record(self, state: str, entries: list) -> None:
+        '''
+        Durably records state of all (link, file) entries
+        '''
+        if not entries or self.descriptor is None:
+            return
+        write(self.descriptor, b''.join(fsencode(f'{state}\x00{link}\x00{link_file}\x00') \
+            for link, link_file in entries))
+        fsync(self.descriptor)
+
+    def close(self) -> None:
+        '''
+        Closes the journal
+        '''
+        if self.descriptor is not None:
+            close(self.descriptor)
+            self.descriptor = None
@@ -0,0 +1,250 @@
+#!/usr/bin/python3
+# vim: set fileencoding=utf-8 :
+# Version 1.0.0
+'''
+Throughput instrumentation of the drain.
+DrainMetrics holds latency histograms of the transfer stages and the number
+of busy workers in shared memory, so all pool processes can update them.
+The drain collects the rest (found, done, queued) into a snapshot dict,
+which is reported by a periodic status line and by a local HTTP endpoint
+in Prometheus text format.
+'''
+from contextlib import contextmanager
+from ctypes import c_longlong
+from multiprocessing import Array, Value
+from threading import Event, Thread
+from time import monotonic
+from typing import Callable, Generator, Union
+
+STAGES: tuple = ('mkdir', 'rsync', 'link')
+# Upper bounds of the histogram buckets in seconds, the last bucket is +Inf
+BUCKETS: tuple = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0)
+STATUS_INTERVAL: float = 60.0
+PREFIX: str = 'xrd_drain'
+
+
+class DrainMetrics:
+    '''
+    Stage latency histograms and busy workers shared by all processes,
+    must be created before the pools are forked
+    '''
+    def __init__(self) -> None:
+        self.histograms: Array = Array(c_longlong, len(STAGES) * (len(BUCKETS) + 1))
+        self.sums: Array = Array('d', len(STAGES))
+        self.busy: Value = Value('i', 0)
+        self.started: float = monotonic()
+
+    def observe(self, stage: str, seconds: float) -> None:
+        '''
+        Adds one measured duration of stage
+        '''
+        stage_index: int = STAGES.index(stage)
+        bucket: int = len(BUCKETS)
+        for bucket_index, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                bucket = bucket_index
+                break
+        with self.histograms.get_lock():
+            self.histograms[stage_index * (len(BUCKETS) + 1) + bucket] += 1
+            self.sums[stage_index] += seconds
+
+    @contextmanager
+    def timed(self, stage: str) -> Generator:
+        '''
+        Measures the duration of the with block as stage
+        '''
+        start: float = monotonic()
+        try:
+            yield
+        finally:
+            self.observe(stage, monotonic() - start)
+
+    @contextmanager
+    def working(self) -> Generator:
+        '''
+        Counts the calling worker as busy for the with block
+        '''
+        with self.busy.get_lock():
+            self.busy.value += 1
+        try:
+            yield
+        finally:
+            with self.busy.get_lock():
+                self.busy.value -= 1
+
+    def histogram(self, stage: str) -> tuple:
+        '''
+        Returns (counts of the buckets, not cumulative, sum of durations) of stage
+        '''
+        stage_index: int = STAGES.index(stage)
+        width: int = len(BUCKETS) + 1
+        with self.histograms.get_lock():
+            return (self.histograms[stage_index * width:(stage_index + 1) * width], \
+                self.sums[stage_index])
+
+    def quantile(self, stage: str, fraction: float) -> Union[float, None]:
+        '''
+        Upper bound of the bucket holding fraction of the durations of stage,
+        None when nothing was measured (inf when it is in the last bucket)
+        '''
+        counts, _ = self.histogram(stage)
+        total: int = sum(counts)
+        if not total:
+            return None
+        running: int = 0
+        for bound, bucket_count in zip(BUCKETS + (float('inf'),), counts):
+            running += bucket_count
+            if running >= fraction * total:
+                return bound
+        return float('inf')
+
+
+def eta(snapshot: dict) -> Union[float, None]:
+    '''
+    Seconds left by the average rate, None while the name space is still scanned
+    '''
+    if snapshot['scanning']:
+        return None
+    if snapshot['bytes'] and snapshot['found_bytes']:
+        done: float = snapshot['bytes'] / snapshot['found_bytes']
+    elif snapshot['files'] and snapshot['found_files']:
+        done = snapshot['files'] / snapshot['found_files']
+    else:
+        return None
+    return snapshot['elapsed'] * max(1 - done, 0.0) / done
+
+
+def duration(seconds: Union[float, None]) -> str:
+    '''
+    Seconds as "1d02:03:04", "-" when unknown
+    '''
+    if seconds is None:
+        return '-'
+    days, rest = divmod(int(seconds), 86_400)
+    hours, rest = divmod(rest, 3_600)
+    return f'{f"{days}d" if days else ""}{hours:02}:{rest // 60:02}:{rest % 60:02}'
+
+
+def status_line(snapshot: dict, last: Union[dict, None], metrics: DrainMetrics) -> str:
+    '''
+    One line summary of snapshot, rates are computed since last snapshot
+    '''
+    if last is None:
+        last = {'files': 0, 'bytes': 0, 'elapsed': 0.0}
+    elapsed: float = max(snapshot['elapsed'] - last['elapsed'], 1e-9)
+    latencies: str = ' '.join(f'{stage} p50/p95 ' + '/'.join('-' if bound is None else \
+        f'{bound:g}' for bound in (metrics.quantile(stage, 0.5), metrics.quantile(stage, 0.95))) \
+        + 's' for stage in STAGES)
+    queued: str = ' '.join(f'{lane["name"]}={lane["queued"]:_}' for lane in snapshot['lanes'])
+    return f'Status: {snapshot["files"]:_}/{snapshot["found_files"]:_} files, '\
+        f'{snapshot["bytes"] / (1 << 30):.2f}/{snapshot["found_bytes"] / (1 << 30):.2f} GiB, '\
+        f'{(snapshot["files"] - last["files"]) / elapsed:.1f} files/s, '\
+        f'{(snapshot["bytes"] - last["bytes"]) / elapsed / (1 << 20):.1f} MiB/s, '\
+        f'{snapshot["failures"]:_} failures, busy {snapshot["busy"]}/{snapshot["workers"]}, '\
+        f'queued {queued}, {latencies}, '\
+        f'{"scanning" if snapshot["scanning"] else "scan done"}, '\
+        f'elapsed {duration(snapshot["elapsed"])}, ETA {duration(eta(snapshot))}'
+
+
+def prometheus(snapshot: dict, metrics: DrainMetrics) -> str:
+    '''
+    snapshot and stage histograms in Prometheus text exposition format
+    '''
+    lines: list = []
+
+    def metric(name: str, kind: str, help_text: str, samples: list) -> None:
+        lines.append(f'# HELP {PREFIX}_{name} {help_text}')
+        lines.append(f'# TYPE {PREFIX}_{name} {kind}')
+        for labels, value in samples:
+            lines.append(f'{PREFIX}_{name}{labels} {value}')
+
+    metric('files_total', 'counter', 'Migrated files.', [('', snapshot['files'])])
+    metric('bytes_total', 'counter', 'Migrated bytes.', [('', snapshot['bytes'])])
+    metric('failures_total', 'counter', 'Connection failures.', [('', snapshot['failures'])])
+    metric('found_files', 'gauge', 'Files found to migrate.', [('', snapshot['found_files'])])
+    metric('found_bytes', 'gauge', 'Bytes found to migrate.', [('', snapshot['found_bytes'])])
+    metric('scanning', 'gauge', 'Name space scan is running.', [('', int(snapshot['scanning']))])
+    metric('busy_workers', 'gauge', 'Workers transferring a batch.', [('', snapshot['busy'])])
+    metric('workers', 'gauge', 'Workers of all destinations.', [('', snapshot['workers'])])
+    metric('elapsed_seconds', 'gauge', 'Run time of the drain.', [('', snapshot['elapsed'])])
+    remaining: Union[float, None] = eta(snapshot)
+    metric('eta_seconds', 'gauge', 'Estimated time left (NaN while scanning).', \
+        [('', 'NaN' if remaining is None else remaining)])
+    for name, key, kind, help_text in [
+        ('queued_batches', 'queued', 'gauge', 'Batches waiting for workers.'),
+        ('active_workers', 'active', 'gauge', 'Workers allowed to run by the controller.'),
+        ('destination_files_total', 'files', 'counter', 'Migrated files by destination.'),
+        ('destination_bytes_total', 'bytes', 'counter', 'Migrated bytes by destination.')]:
+        metric(name, kind, help_text, \
+            [(f'{{destination="{lane["name"]}"}}', lane[key]) for lane in snapshot['lanes']])
+    lines.append(f'# HELP {PREFIX}_stage_seconds Duration of transfer stages.')
+    lines.append(f'# TYPE {PREFIX}_stage_seconds histogram')
+    for stage in STAGES:
+        counts, seconds = metrics.histogram(stage)
+        running: int = 0
+        for bound, bucket_count in zip(BUCKETS + ('+Inf',), counts):
+            running += bucket_count
+            lines.append(f'{PREFIX}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} '\
+                f'{running}')
+        lines.append(f'{PREFIX}_stage_seconds_sum{{stage="{stage}"}} {seconds}')
+        lines.append(f'{PREFIX}_stage_seconds_count{{stage="{stage}"}} {running}')
+    return '\n'.join(lines) + '\n'
+
+
+def serve_metrics(address: str,
+    port: int,
+    collect: Callable,
+    metrics: DrainMetrics) -> object:
+    '''
+    Starts HTTP server (in a daemon thread) answering every GET
+    by prometheus() of collect(), stop it by shutdown()
+    '''
+    # Imported only when the endpoint is used, http.server.ThreadingHTTPServer is 3.7+
+    # pylint: disable=import-outside-toplevel
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+    class MetricsServer(ThreadingMixIn, HTTPServer):
+        '''
+        HTTP server handling every request in its own thread
+        '''
+        daemon_threads: bool = True
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        '''
+        Prometheus text endpoint
+        '''
+        def do_GET(self) -> None:  # pylint: disable=invalid-name
+            '''
+            Answers with current metrics
+            '''
+            body: bytes = prometheus(collect(), metrics).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *_) -> None:  # pylint: disable=arguments-differ
+            '''
+            Scrapes are not logged
+            '''
+
+    server: MetricsServer = MetricsServer((address, port), MetricsHandler)
+    Thread(target=server.serve_forever, name='drain metrics', daemon=True).start()
+    return server
+
+
+def report_status(stop: Event,
+    collect: Callable,
+    metrics: DrainMetrics,
+    report: Callable = print,
+    interval: float = STATUS_INTERVAL) -> None:
+    '''
+    Reports status_line() every interval seconds until stop is set (run in a thread)
+    '''
+    last: Union[dict, None] = None
+    while not stop.wait(interval):
+        snapshot: dict = collect()
+        report(status_line(snapshot, last, metrics))
+        last = snapshot
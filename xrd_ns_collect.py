@@ -4,96 +4,49 @@
 '''
 Collects entries from namespaces of supplied servers
 and saves it to one file per server and one file with all entries
-This script can be quite memory intensive (~32GB RAM @ ~140M entries)
+Every server is collected, sorted and written by its own thread,
+the file with all entries is merged from the sorted server lists at the end.
+With the default engine this script can be quite memory intensive
+(~32GB RAM @ ~140M entries), --engine=merge sorts the entries on disk.
 '''
-from os import path, cpu_count, scandir
-from sys import argv, exit, stderr # pylint: disable=redefined-builtin
-from subprocess import call, Popen, PIPE
-from threading import Lock, Condition, Thread
-from typing import Generator
+from os import path, cpu_count
+from sys import argv, exit, stdout # pylint: disable=redefined-builtin
+from subprocess import call
+from threading import Lock, Thread
 from re import sub, escape, match
 from datetime import datetime
+from gzip import open as gzip_open
+from heapq import merge
+from itertools import groupby, islice
+from typing import Generator, Iterable, TextIO, Union
+from xrd_walk import scan, LINK, MODULE_FILE as WALK_MODULE_FILE
+from xrd_index import ScanIndex, MODULE_FILE as INDEX_MODULE_FILE
+from xrd_extsort import ExternalSorter, MODULE_FILE as EXTSORT_MODULE_FILE
+from xrd_wire import encode_paths, remote_entries, MODULE_FILE as WIRE_MODULE_FILE
 
 THREADS: int = cpu_count()*2
+PROCESSES: int = 0
 NOW: str = datetime.isoformat(datetime.now(),timespec='seconds')
-REMOTE_SCRIPT: str = f'/tmp/{NOW}-{path.basename(argv[0])}'
-
-def walk(top: str,
-    threads: int = THREADS,
-    separate_links: bool = True,
-    full_paths: bool = True) -> Generator:
-    '''
-    Multi-threaded version of os.walk() with some improvements
-    '''
-    if not path.isdir(top):
-        return
-    lock: Lock = Lock()
-    on_input: Condition = Condition(lock)
-    on_output: Condition = Condition(lock)
-    state: dict = {'tasks': 1}
-    paths: set = {top}
-    output: list = []
-
-    def worker() -> None:
-        while True:
-            with lock:
-                while True:
-                    if not state['tasks']:
-                        output.append(None)
-                        on_output.notify()
-                        return
-                    if not paths:
-                        on_input.wait()
-                        continue
-                    fs_path: str = paths.pop()
-                    break
-            try:
-                dirs: set = set()
-                files: set = set()
-                links: set = set()
-                for item in scandir(fs_path):
-                    item_name: str = item.name
-                    if full_paths:
-                        item_name = item.path
-                    if item.is_symlink():
-                        if separate_links:
-                            links.add(item_name)
-                        else:
-                            files.add(item_name)
-                    elif item.is_file():
-                        files.add(item_name)
-                    else:
-                        dirs.add(item_name)
-                        with lock:
-                            state['tasks'] += 1
-                            paths.add(item.path)
-                            on_input.notify()
-                with lock:
-                    if separate_links:
-                        output.append((fs_path, dirs, files, links))
-                    else:
-                        output.append((fs_path, dirs, files))
-                    on_output.notify()
-            except OSError as exception:
-                print(exception, error=True)
-            finally:
-                with lock:
-                    state['tasks'] -= 1
-                    if not state['tasks']:
-                        on_input.notify_all()
-
-    workers: list = [Thread(target=worker, name=f'fastio.walk {i} {top}') for i in range(threads)]
-    for start_worker in workers:
-        start_worker.start()
-    while threads or output:
-        with lock:
-            while not output:
-                on_output.wait()
-            item: tuple = output.pop()
-        if item:
-            yield item
-        else:
-            threads -= 1
+REMOTE_DIRECTORY: str = f'/tmp/{NOW}-xrdtools'
+REMOTE_SCRIPT: str = f'{REMOTE_DIRECTORY}/{path.basename(argv[0])}'
+REMOTE_FILES: list = [argv[0], WALK_MODULE_FILE, INDEX_MODULE_FILE, EXTSORT_MODULE_FILE, \
+    WIRE_MODULE_FILE]
+ENGINE: str = 'memory'
+TMP_DIRECTORY: str = ''
+COMPRESS_OUTPUT: bool = False
+SHARD: bool = False
+# Lines written by one write() call
+WRITE_BATCH: int = 10_000
+
+def pop_option(name: str, default: str = '') -> str:
+    '''
+    Removes all "--name=value" options from argv, returns the last value
+    '''
+    value: str = default
+    for option in [arg for arg in argv[1:] if arg.startswith(f'--{name}=')]:
+        argv.remove(option)
+        value = option.split('=', 1)[1]
+    return value
 
 
 def check_if_dir_exists(check_dir: str, my_name: str) -> None:
@@ -140,21 +93,97 @@ def parse_server(server_string: str) -> tuple:
     return (server_string_w, parse_params)
 
 
+def open_list(list_name: str, mode: str = 'w') -> TextIO:
+    '''
+    Opens list_name.txt (list_name.txt.gz with --compress-output) for writing (or appending)
+    '''
+    if COMPRESS_OUTPUT:
+        return gzip_open(f'{list_name}.txt.gz', f'{mode}t', compresslevel=6, encoding='utf-8', \
+            errors='surrogateescape')
+    return open(f'{list_name}.txt', mode, encoding='utf-8', errors='surrogateescape')
+
+
+def shard_key(entry: str) -> str:
+    '''
+    Top directory of entry, entries of one top directory are adjacent in sorted lists
+    (only entries directly in the name space, shard '', can be split by directories)
+    '''
+    return entry.split('/', 1)[0] if '/' in entry else ''
+
+
+def write_list(list_name: str, entries: Iterable) -> None:
+    '''
+    Writes sorted entries in batches of WRITE_BATCH lines,
+    with --shard to one list_name-<top directory> file per top directory of the entries,
+    entries directly in the name space go to list_name (no directory name can give it)
+    '''
+    entries = iter(entries)
+    shards: Iterable = groupby(entries, shard_key) if SHARD else [('', entries)]
+    written: set = set()
+    for shard, shard_entries in shards:
+        with open_list(f'{list_name}-{shard}' if SHARD and shard else list_name, \
+            'a' if shard in written else 'w') as list_file:
+            if shard not in written:
+                list_file.write(f'List from {NOW}\n')
+                written.add(shard)
+            for batch in iter(lambda: list(islice(shard_entries, WRITE_BATCH)), []):
+                list_file.write('\n'.join(batch))
+                list_file.write('\n')
+
+
+def sorted_entries(entries: Union[list, ExternalSorter]) -> Iterable:
+    '''
+    Sorted entries of one server (sorted list or ExternalSorter of --engine=merge)
+    '''
+    if isinstance(entries, ExternalSorter):
+        return entries.sorted()
+    return entries
 
 
 
 if __name__ == '__main__':
+    PROCESSES_OPTION: str = pop_option('processes', '0')
+    if not match(r'^\d+$', PROCESSES_OPTION):
+        exit(f'{PROCESSES_OPTION} is not a valid number of processes.')
+    PROCESSES = int(PROCESSES_OPTION)
+    INDEX_FILE: str = pop_option('index')
+    ENGINE = pop_option('engine', ENGINE)
+    if ENGINE not in {'memory', 'merge'}:
+        exit(f'{ENGINE} is not a valid engine, use "memory" or "merge".')
+    TMP_DIRECTORY = pop_option('tmpdir', TMP_DIRECTORY)
+    if TMP_DIRECTORY:
+        check_if_dir_exists(TMP_DIRECTORY, argv[0])
+    COMPRESS_OUTPUT = '--compress-output' in argv
+    if COMPRESS_OUTPUT:
+        argv.remove('--compress-output')
+    SHARD = '--shard' in argv
+    if SHARD:
+        argv.remove('--shard')
+    COMPRESS: bool = '--compress' in argv
+    if COMPRESS:
+        argv.remove('--compress')
     if ('-h' in argv) or ('--help' in argv) or len(argv) == 1:
         print('This script is to be used in this way:')
-        print(f'{argv[0]} [user1@]server1[port]/name/space/path1 '\
+        print(f'{argv[0]} [--processes=N] [--index=/index/file] [--compress] '\
+            '[--engine=memory|merge] [--tmpdir=/path] [--compress-output] [--shard] '\
+            '[user1@]server1[port]/name/space/path1 '\
             '[user2@]server2[port]/name/space/path2'\
             '... [userN@]serverN[portN]/name/space/pathN')
         print('You can omit user and port for defualts ("root" and "22").')
+        print('--processes=N scans the remote namespaces with N processes instead of threads.')
+        print('--index=/index/file keeps remote directory listings between runs (on each server),')
+        print('  only directories with changed mtime are listed again (threaded scan only).')
+        print('--compress sends the remote listings front-coded and zlib compressed.')
+        print('--engine=merge sorts the entries on disk (in --tmpdir) instead of memory.')
+        print('--compress-output writes gzip compressed lists (.txt.gz).')
+        print('--shard writes one list per top directory of the name space '\
+            '(/tmp/<server>-<date>_file_list-<top directory>.txt),')
+        print('  entries directly in the name space go to /tmp/<server>-<date>_file_list.txt.')
         print(f'Example: {argv[0]} alice@xrd1.example.com:2222/xrd/space/ '\
             'bob@xrd2/bobsxrd/space/path')
         exit(0)
 
-    SERVERS: dict = {'to_process': set(), 'servers': set(), 'all_files': set()}
+    SERVERS: dict = {'to_process': set(), 'servers': set()}
     COLLECT: bool =  bool('COllECt_dATa' == argv[1])
 
     if COLLECT:
@@ -162,9 +191,20 @@ if __name__ == '__main__':
         NAMESPACE: str = argv[3]
         NAMESPACE_RE: str = escape(NAMESPACE)
         check_if_dir_exists(NAMESPACE, MY_NAME)
-        for _, _, _, ns_entries in walk(NAMESPACE):
-            for ns_entry in ns_entries:
-                print(f"{sub(f'^{NAMESPACE_RE}', '', ns_entry)}", end = '\x00')
+        INDEX: Union[ScanIndex, None] = None
+        if INDEX_FILE:
+            INDEX = ScanIndex(INDEX_FILE)
+        if COMPRESS:
+            for wire_chunk in encode_paths(sub(f'^{NAMESPACE_RE}', '', ns_entry.path) \
+                for ns_entry in scan(NAMESPACE, THREADS, processes=PROCESSES, index=INDEX) \
+                if ns_entry.kind == LINK):
+                stdout.buffer.write(wire_chunk)
+        else:
+            for ns_entry in scan(NAMESPACE, THREADS, processes=PROCESSES, index=INDEX):
+                if ns_entry.kind == LINK:
+                    print(f"{sub(f'^{NAMESPACE_RE}', '', ns_entry.path)}", end = '\x00')
+        if INDEX:
+            INDEX.close()
     else:
         for SERVER_ARG in argv[1:]:
             server: str = ''
@@ -173,7 +213,10 @@ if __name__ == '__main__':
             SERVERS[server] = server_params
             SERVERS['to_process'].add(server)
             SERVERS['servers'].add(server)
-            SERVERS[server]['entries']: set = set()
+            if ENGINE == 'merge':
+                SERVERS[server]['entries']: ExternalSorter = ExternalSorter(TMP_DIRECTORY)
+            else:
+                SERVERS[server]['entries']: set = set()
 
         COLLECT_LOCK: Lock = Lock()
 
@@ -186,23 +229,32 @@ if __name__ == '__main__':
             port: str = SERVERS[get_server]['port']
             user: str = SERVERS[get_server]['user']
             name_space: str = SERVERS[get_server]['name_space']
-            if call([
+            server_entries: Union[set, ExternalSorter] = SERVERS[get_server]['entries']
+            if call(['/usr/bin/ssh', '-p', port, '-l', user,
+                get_server, f'/usr/bin/mkdir -p -m 700 {REMOTE_DIRECTORY}']) == 0 \
+                and call([
                 '/usr/bin/scp', '-q',
                 '-P', port,
-                f'{argv[0]}',
-                f'{user}@{get_server}:{REMOTE_SCRIPT}']) == 0:
-                for entry in Popen(['/usr/bin/ssh',
+                *REMOTE_FILES,
+                f'{user}@{get_server}:{REMOTE_DIRECTORY}/']) == 0:
+                for entry in remote_entries(['/usr/bin/ssh',
                         '-p', port,
                         '-l', user,
                         get_server,
                         f'/usr/bin/python3 {REMOTE_SCRIPT} COllECt_dATa {get_server} '\
-                        f'{name_space}'],
-                        stdout=PIPE, stderr=stderr,).communicate()[0].decode('utf-8').split('\x00'):
-                    with COLLECT_LOCK:
-                        SERVERS['all_files'].add(entry)
-                        SERVERS[get_server]['entries'].add(entry)
+                        f'{name_space} --processes={PROCESSES} --index={INDEX_FILE}'\
+                        f'{" --compress" if COMPRESS else ""}'], COMPRESS):
+                    # Only this thread adds to the entries of its server
+                    server_entries.add(entry)
                 call(['/usr/bin/ssh', '-p', port, '-l', user,
-                    get_server, f'/usr/bin/rm -f {REMOTE_SCRIPT}'])
+                    get_server, f'/usr/bin/rm -rf {REMOTE_DIRECTORY}'])
+            if ENGINE == 'memory':
+                # Sorted list replaces the set, the merge of all servers reads it again
+                SERVERS[get_server]['entries'] = sorted(server_entries)
+                server_entries.clear()
+            # Sorted and written while the other servers are still collected
+            write_list(f'/tmp/{get_server}-{NOW}_file_list', \
+                sorted_entries(SERVERS[get_server]['entries']))
 
         COLLECT_WORKERS: list = [Thread(target=get_entries, \
             name=f'collect_worker {s}') for s in SERVERS['to_process']]
@@ -210,13 +262,22 @@ if __name__ == '__main__':
             collect_worker.start()
         for collect_worker in COLLECT_WORKERS:
             collect_worker.join()
-        for server in SERVERS['servers']:
-            with open(f'/tmp/{server}-{NOW}_file_list.txt', 'w', encoding='utf-8') as server_file:
-                server_file.write(f'List from {NOW}')
-                for server_file_entry in sorted(SERVERS[server]['entries']):
-                    server_file.write(f'{server_file_entry}\n')
-        with open(f'/tmp/ALL_SERVERS-{NOW}_file_list.txt', 'a', encoding='utf-8') as all_file:
-            all_file.write(f'List from {NOW}\n')
-            for all_entry in sorted(SERVERS['all_files']):
-                all_file.write(f'{all_entry}\n')
+
+        def unique(all_entries: Iterable) -> Generator:
+            '''
+            Skips repeated entries of sorted all_entries
+            '''
+            last_entry: Union[str, None] = None
+            for all_entry in all_entries:
+                if all_entry != last_entry:
+                    yield all_entry
+                    last_entry = all_entry
+
+        try:
+            write_list(f'/tmp/ALL_SERVERS-{NOW}_file_list', unique(merge(\
+                *[sorted_entries(SERVERS[server]['entries']) for server in SERVERS['servers']])))
+        finally:
+            for server in SERVERS['servers']:
+                if ENGINE == 'merge':
+                    SERVERS[server]['entries'].close()
     exit(0)
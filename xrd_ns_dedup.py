@@ -5,96 +5,40 @@
 Collects entries from namespaces of supplied servers
 checks them for duplicates accordinf to the server postion in supplied argumets.
 Allows to be delete the duplicates.
-This script can be quite memory intensive (~32GB RAM @ ~140M entries)
+With the default engine this script can be quite memory intensive (~32GB RAM @ ~140M entries),
+--engine=hash keeps the entries in a compact path store (directories stored once),
+--engine=merge sorts the entries of every server on disk and merges them.
 '''
-from os import path, cpu_count, scandir
-from sys import argv, exit, stderr # pylint: disable=redefined-builtin
-from subprocess import call, Popen, PIPE
-from threading import Lock, Condition, Thread
-from typing import Generator
+from os import path, cpu_count
+from heapq import merge
+from shutil import rmtree
+from tempfile import gettempdir, mkdtemp
+from sys import argv, exit, stderr, stdout # pylint: disable=redefined-builtin
+from subprocess import call
+from threading import Lock, Thread
+from typing import Generator, Iterable, Union
 from re import sub, escape, match
 from datetime import datetime
+from itertools import islice
+from xrd_walk import scan, LINK, MODULE_FILE as WALK_MODULE_FILE
+from xrd_index import MODULE_FILE as INDEX_MODULE_FILE
+from xrd_remote import RemoteHelper, MODULE_FILE as REMOTE_MODULE_FILE
+from xrd_extsort import ExternalSorter, read_records, ENCODING, \
+    MODULE_FILE as EXTSORT_MODULE_FILE
+from xrd_pathstore import PathStore, MODULE_FILE as PATHSTORE_MODULE_FILE
+from xrd_wire import encode_paths, remote_entries, MODULE_FILE as WIRE_MODULE_FILE
 
 THREADS: int = cpu_count()*2
 NOW: str = datetime.isoformat(datetime.now(),timespec='seconds')
-
-def walk(top: str,
-    threads: int = THREADS,
-    separate_links: bool = True,
-    full_paths: bool = True) -> Generator:
-    '''
-    Multi-threaded version of os.walk() with some improvements
-    '''
-    if not path.isdir(top):
-        return
-    lock: Lock = Lock()
-    on_input: Condition = Condition(lock)
-    on_output: Condition = Condition(lock)
-    state: dict = {'tasks': 1}
-    paths: set = {top}
-    output: list = []
-
-    def worker() -> None:
-        while True:
-            with lock:
-                while True:
-                    if not state['tasks']:
-                        output.append(None)
-                        on_output.notify()
-                        return
-                    if not paths:
-                        on_input.wait()
-                        continue
-                    fs_path: str = paths.pop()
-                    break
-            try:
-                dirs: set = set()
-                files: set = set()
-                links: set = set()
-                for item in scandir(fs_path):
-                    item_name: str = item.name
-                    if full_paths:
-                        item_name = item.path
-                    if item.is_symlink():
-                        if separate_links:
-                            links.add(item_name)
-                        else:
-                            files.add(item_name)
-                    elif item.is_file():
-                        files.add(item_name)
-                    else:
-                        dirs.add(item_name)
-                        with lock:
-                            state['tasks'] += 1
-                            paths.add(item.path)
-                            on_input.notify()
-                with lock:
-                    if separate_links:
-                        output.append((fs_path, dirs, files, links))
-                    else:
-                        output.append((fs_path, dirs, files))
-                    on_output.notify()
-            except OSError as exception:
-                print(exception, error=True)
-            finally:
-                with lock:
-                    state['tasks'] -= 1
-                    if not state['tasks']:
-                        on_input.notify_all()
-
-    workers: list = [Thread(target=worker, name=f'fastio.walk {i} {top}') for i in range(threads)]
-    for start_worker in workers:
-        start_worker.start()
-    while threads or output:
-        with lock:
-            while not output:
-                on_output.wait()
-            item: tuple = output.pop()
-        if item:
-            yield item
-        else:
-            threads -= 1
-
+REMOTE_DIRECTORY: str = f'/tmp/{NOW}-xrdtools'
+REMOTE_SCRIPT: str = f'{REMOTE_DIRECTORY}/{path.basename(argv[0])}'
+REMOTE_FILES: list = [argv[0], WALK_MODULE_FILE, INDEX_MODULE_FILE, REMOTE_MODULE_FILE, \
+    EXTSORT_MODULE_FILE, WIRE_MODULE_FILE, PATHSTORE_MODULE_FILE]
+ENGINE: str = 'memory'
+ENGINES: set = {'memory', 'hash', 'merge'}
+TMP_DIRECTORY: str = ''
+# Entries sent to the remote remover by one request
+REMOVE_CHUNK: int = 1_000
 
 def check_if_dir_exists(check_dir: str) -> None:
     '''
@@ -142,16 +86,112 @@ def parse_server(server_string: str) -> tuple:
     return (server_string_w, parse_params)
 
 
+def pop_option(name: str, default: str = '') -> str:
+    '''
+    Removes all "--name=value" options from argv, returns the last value
+    '''
+    value: str = default
+    for option in [arg for arg in argv[1:] if arg.startswith(f'--{name}=')]:
+        argv.remove(option)
+        value = option.split('=', 1)[1]
+    return value
+
+
+def tagged(listing: Iterable, priority: int) -> Generator:
+    '''
+    Yields (entry, priority) for sorted listing, the k-way merge keeps ties in priority order
+    '''
+    for entry in listing:
+        yield (entry, priority)
+
+
+def find_duplicates(servers: list, union: Union[set, PathStore, None] = None) -> None:
+    '''
+    Adds entries found on a server with higher priority (earlier in servers)
+    to 'to_remove' of the server, 'entries' of the servers are
+    sets (memory), NUL separated listing files (hash) or ExternalSorters (merge)
+    of entries relative to the name spaces, union (of memory and hash) collects
+    the entries seen so far
+    '''
+    if ENGINE == 'merge':
+        last_entry: Union[str, None] = None
+        for entry, priority in merge(*[tagged(server['entries'].sorted(), priority) \
+            for priority, server in enumerate(servers)]):
+            if entry == last_entry:
+                servers[priority]['to_remove'].add(f'{servers[priority]["name_space"]}{entry}')
+            else:
+                last_entry = entry
+        return
+    for server in servers:
+        if ENGINE == 'hash':
+            with open(server['entries'], 'r', **ENCODING) as listing_handle:
+                for entry in read_records(listing_handle):
+                    if entry in union:
+                        server['to_remove'].add(f'{server["name_space"]}{entry}')
+                    else:
+                        union.add(entry)
+        elif union is None:
+            # Entries of the first server are the start of the union
+            union = server['entries']
+        else:
+            for entry in server['entries']:
+                if entry in union:
+                    server['to_remove'].add(f'{server["name_space"]}{entry}')
+                else:
+                    union.add(entry)
+
+
+def remove_entries(remove_server: str, remove_params: dict, entries: Iterable) -> dict:
+    '''
+    Deletes entries (and the files they point to) on server through one persistent
+    remote helper (xrd_remote), which runs the deletes in parallel,
+    returns counts of removed entries, removed data files and failed entries
+    '''
+    helper: RemoteHelper = RemoteHelper(['/usr/bin/ssh', '-p', remove_params['port'], \
+        '-l', remove_params['user'], '-x', '-T', remove_server])
+    counts: dict = {'removed': 0, 'files': 0, 'failed': 0}
+    entries = iter(entries)
+    try:
+        while True:
+            chunk: list = list(islice(entries, REMOVE_CHUNK))
+            if not chunk:
+                break
+            result: dict = helper.request('remove', links=chunk)
+            if 'error' in result:
+                print(f'Removal on server {remove_server} failed: {result["error"]}', \
+                    file=stderr)
+                counts['failed'] += len(chunk)
+                continue
+            counts['removed'] += result['removed']
+            counts['files'] += result['files']
+            counts['failed'] += len(result['failed'])
+    finally:
+        helper.close()
+    return counts
 
 
 
 if __name__ == '__main__':
+    ENGINE = pop_option('engine', ENGINE)
+    if ENGINE not in ENGINES:
+        exit(f'{ENGINE} is not a valid engine, use "memory", "hash" or "merge".')
+    TMP_DIRECTORY = pop_option('tmpdir', TMP_DIRECTORY)
+    if TMP_DIRECTORY:
+        check_if_dir_exists(TMP_DIRECTORY)
+    COMPRESS: bool = '--compress' in argv
+    if COMPRESS:
+        argv.remove('--compress')
     if ('-h' in argv) or ('--help' in argv) or len(argv) == 1:
         print('This script is to be used in this way:')
-        print(f'{argv[0]} [user1@]server1[port]/name/space/path1 '\
+        print(f'{argv[0]} [--compress] [--engine=memory|hash|merge] [--tmpdir=/path] '\
+            '[user1@]server1[port]/name/space/path1 '\
             '[user2@]server2[port]/name/space/path2'\
             '... [userN@]serverN[portN]/name/space/pathN')
         print('You can omit user and port for defualts ("root" and "22").')
+        print('--compress sends the remote listings front-coded and zlib compressed.')
+        print('--engine=hash keeps the entries in a compact hash store (and on disk in --tmpdir)')
+        print('  instead of sets, --engine=merge sorts them on disk and merges them,')
+        print('  duplicates are kept on disk by both of them.')
         print(f'Example: {argv[0]} alice@xrd1.example.com:2222/xrd/space/ '\
             'bob@xrd2/bobsxrd/space/path')
         exit(0)
@@ -162,12 +202,17 @@ if __name__ == '__main__':
         NAMESPACE: str = argv[2]
         NAMESPACE_RE: str = escape(NAMESPACE)
         check_if_dir_exists(NAMESPACE)
-        for _, _, _, ns_entries in walk(NAMESPACE):
-            for ns_entry in ns_entries:
-                print(ns_entry, end = '\x00')
+        if COMPRESS:
+            for wire_chunk in encode_paths(ns_entry.path for ns_entry in scan(NAMESPACE, THREADS) \
+                if ns_entry.kind == LINK):
+                stdout.buffer.write(wire_chunk)
+        else:
+            for ns_entry in scan(NAMESPACE, THREADS):
+                if ns_entry.kind == LINK:
+                    print(ns_entry.path, end = '\x00')
     else:
-        SERVERS: dict = {'to_process': [], 'servers': [], 'all_files': set()}
-        FIRST_SERVER: bool = True
+        SERVERS: dict = {'to_process': [], 'servers': []}
+        LISTINGS_DIRECTORY: str = mkdtemp(prefix='xrd-dedup-', dir=TMP_DIRECTORY or gettempdir())
         for SERVER_ARG in argv[1:]:
             server: str = ''
             server_params: dict = {}
@@ -175,10 +220,17 @@ if __name__ == '__main__':
             SERVERS[server] = server_params
             SERVERS['to_process'].append(server)
             SERVERS['servers'].append(server)
-            SERVERS[server]['entries']: set = set()
-            SERVERS[server]['to_remove']: set = set()
-            SERVERS[server]['first']: bool = FIRST_SERVER
-            FIRST_SERVER = False
+            if ENGINE == 'memory':
+                SERVERS[server]['entries']: set = set()
+            elif ENGINE == 'hash':
+                SERVERS[server]['entries']: str = \
+                    f'{LISTINGS_DIRECTORY}/{len(SERVERS["servers"]):04}.listing'
+                # Unreachable server keeps empty listing (like the sets of the other engines)
+                with open(SERVERS[server]['entries'], 'w', **ENCODING):
+                    pass
+            else:
+                SERVERS[server]['entries']: ExternalSorter = ExternalSorter(LISTINGS_DIRECTORY)
+            SERVERS[server]['to_remove']: ExternalSorter = ExternalSorter(LISTINGS_DIRECTORY)
 
         COLLECT_LOCK: Lock = Lock()
 
@@ -192,29 +244,31 @@ if __name__ == '__main__':
             user: str = SERVERS[get_server]['user']
             name_space: str = SERVERS[get_server]['name_space']
             name_space_re: str = f'^{escape(name_space)}'
-            remote_script: str = f'/tmp/{NOW}-{path.basename(argv[0])}'
-            if call([
+            # Only this thread adds to the entries of its server, they are merged at the end
+            server_entries: Union[set, str, ExternalSorter] = SERVERS[get_server]['entries']
+            if call(['/usr/bin/ssh', '-p', port, '-l', user,
+                get_server, f'/usr/bin/mkdir -p -m 700 {REMOTE_DIRECTORY}']) == 0 \
+                and call([
                 '/usr/bin/scp', '-q',
                 '-P', port,
-                f'{argv[0]}',
-                f'{user}@{get_server}:{remote_script}']) == 0:
-                for entry in Popen(['/usr/bin/ssh',
+                *REMOTE_FILES,
+                f'{user}@{get_server}:{REMOTE_DIRECTORY}/']) == 0:
+                entries: Generator = (sub(name_space_re, '', entry) \
+                    for entry in remote_entries(['/usr/bin/ssh',
                         '-p', port,
                         '-l', user,
                         get_server,
-                        f'/usr/bin/python3 {remote_script} COllECt_dATa '\
-                        f'{name_space}'],
-                        stdout=PIPE, stderr=stderr,\
-                        ).communicate()[0].decode('utf-8').split('\x00'):
-                    if entry != '':
-                        with COLLECT_LOCK:
-                            if SERVERS[get_server]['first']:
-                                global_entry: str = f'{sub(name_space_re, "", entry)}'
-                                SERVERS['all_files'].add(global_entry)
-                            else:
-                                SERVERS[get_server]['entries'].add(entry)
+                        f'/usr/bin/python3 {REMOTE_SCRIPT} COllECt_dATa '\
+                        f'{name_space}{" --compress" if COMPRESS else ""}'], COMPRESS))
+                if ENGINE == 'hash':
+                    with open(server_entries, 'w', **ENCODING) as listing_handle:
+                        for entry in entries:
+                            listing_handle.write(f'{entry}\x00')
+                else:
+                    for entry in entries:
+                        server_entries.add(entry)
                 call(['/usr/bin/ssh', '-p', port, '-l', user,
-                    get_server, f'/usr/bin/rm -f {remote_script}'])
+                    get_server, f'/usr/bin/rm -rf {REMOTE_DIRECTORY}'])
 
         COLLECT_WORKERS: list = [Thread(target=get_entries, \
             name=f'collect_worker {s}') for s in SERVERS['to_process']]
@@ -223,49 +277,59 @@ if __name__ == '__main__':
         for collect_worker in COLLECT_WORKERS:
             collect_worker.join()
 
-        for server in SERVERS['servers']:
-            if not SERVERS[server]['first']:
-                re_name_space: str = f'^{escape(SERVERS[server]["name_space"])}'
-                for entry_local in SERVERS[server]['entries']:
-                    entry_global: str = f'{sub(re_name_space, "", entry_local)}'
-                    if entry_global not in SERVERS['all_files']:
-                        SERVERS['all_files'].add(entry_global)
-                    else:
-                        SERVERS[server]['to_remove'].add(entry_local)
-            del SERVERS[server]['entries']
+        try:
+            find_duplicates([SERVERS[server] for server in SERVERS['servers']], \
+                # Hits are deleted, the names are kept to verify every hash match
+                PathStore(keep_names=True) if ENGINE == 'hash' else None)
+        finally:
+            for server in SERVERS['servers']:
+                if ENGINE == 'merge':
+                    SERVERS[server]['entries'].close()
+                del SERVERS[server]['entries']
 
-        del SERVERS['all_files']
+        USER_ACTION: str = ''
+        DUPLICATES: int = sum(len(SERVERS[server]['to_remove']) for server in SERVERS['servers'])
+        while DUPLICATES > 0 and USER_ACTION not in {'q', 'Q', 'D', 'd'}:
+            for server in SERVERS['servers']:
+                if len(SERVERS[server]['to_remove']):
+                    print(f'Found {len(SERVERS[server]["to_remove"])} duplicate entries '\
+                        f'on server {server}')
+            print('What would you like to do about it?')
+            USER_ACTION = input('(D)elete entries on all servers\n(L)ist entries'\
+                '\n(Q)uit and do nothing about it\n')
+            if USER_ACTION in {'D', 'd'}:
+                REMOVE_RESULTS: dict = {}
 
+                def remove_worker(remove_server: str) -> None:
+                    '''
+                    Deletes duplicates of one server
+                    '''
+                    REMOVE_RESULTS[remove_server] = remove_entries(remove_server, \
+                        SERVERS[remove_server], SERVERS[remove_server]['to_remove'].sorted())
+
+                REMOVE_WORKERS: list = [Thread(target=remove_worker, args=(server,), \
+                    name=f'remove_worker {server}') for server in SERVERS['servers'] \
+                    if len(SERVERS[server]['to_remove'])]
+                for remove_thread in REMOVE_WORKERS:
+                    remove_thread.start()
+                for remove_thread in REMOVE_WORKERS:
+                    remove_thread.join()
+                for server in SERVERS['servers']:
+                    if server in REMOVE_RESULTS:
+                        print(f'Server {server}: removed {REMOVE_RESULTS[server]["removed"]} '\
+                            f'duplicate entries ({REMOVE_RESULTS[server]["files"]} data files), '\
+                            f'{REMOVE_RESULTS[server]["failed"]} failed')
+                print('Duplicate entries were deleted.')
+            elif USER_ACTION in {'L', 'l'}:
+                for server in SERVERS['servers']:
+                    if len(SERVERS[server]['to_remove']):
+                        print(f'Server {server}:')
+                        print('\n'.join(SERVERS[server]['to_remove'].sorted()))
+            elif USER_ACTION in {'q', 'Q'}:
+                pass
+            else:
+                print(f'Unknown choice "{USER_ACTION}"!')
         for server in SERVERS['servers']:
-            USER_ACTION: str = ''
-            entry_len: int = len(SERVERS[server]['to_remove'])
-            if entry_len > 0:
-                while USER_ACTION not in {'q', 'Q', 'D', 'd'}:
-                    print(f'Found {entry_len} duplicate entries on server {server}')
-                    print('What would you like to do about it?')
-                    USER_ACTION = input('(D)elete entries\n(L)ist entries'\
-                        '\n(Q)uit and do nothing about it\n')
-                    if USER_ACTION in {'D', 'd'}:
-                        REMOVE_ITERATOR: int = 0
-                        REMOVE_COMMAND: str = ''
-                        for remove_entry in SERVERS[server]['to_remove']:
-                            REMOVE_COMMAND += f' "$(/usr/bin/readlink "{remove_entry}")"'
-                            REMOVE_COMMAND += f' "{remove_entry}"'
-                            REMOVE_ITERATOR += 1
-                            if REMOVE_ITERATOR % 100 == 0 or REMOVE_ITERATOR == entry_len:
-                                call([
-                                    '/usr/bin/ssh',
-                                    '-p', SERVERS[server]['port'],
-                                    '-l', SERVERS[server]['user'],
-                                    server,
-                                    f'/usr/bin/rm -f {REMOVE_COMMAND}'])
-                                REMOVE_COMMAND = ''
-                        print('Duplicate entries were deleted.')
-                    elif USER_ACTION in {'L', 'l'}:
-                        print('\n'.join(SERVERS[server]['to_remove']))
-                    elif USER_ACTION in {'q', 'Q'}:
-                        pass
-                    else:
-                        print(f'Unknown choice "{USER_ACTION}"!')
-            del SERVERS[server]['to_remove']
+            SERVERS[server]['to_remove'].close()
+        rmtree(LISTINGS_DIRECTORY, ignore_errors=True)
     exit(0)
@@ -0,0 +1,145 @@
+#!/usr/bin/python3
+# vim: set fileencoding=utf-8 :
+# Version 1.0.0
+'''
+Compact set of absolute paths for tens of millions of entries.
+Paths are split into a directory prefix table and basenames,
+membership is answered by an open addressing table of 64-bit path hashes
+where every hash is verified by the directory id stored next to it
+and by the basename (or by an independent 32-bit hash of it in membership only stores).
+'''
+from array import array
+from os import path
+from typing import Generator, Iterable
+
+MASK_64: int = 0xFFFF_FFFF_FFFF_FFFF
+MASK_32: int = 0xFFFF_FFFF
+MAX_LOAD: float = 0.7
+MIN_CAPACITY: int = 1 << 10
+MODULE_FILE: str = path.abspath(__file__)
+
+
+class PathStore:
+    '''
+    Set like store of paths, iterable only when created with keep_names
+    (membership only store keeps just 16 bytes per slot, a false positive needs
+    both hashes of a path to collide, use keep_names where it must never happen)
+    '''
+    def __init__(self, expected: int = 0, keep_names: bool = False) -> None:
+        self.directory_index: dict = {}
+        self.directories: list = []
+        self.keep_names: bool = keep_names
+        self.names: list = []
+        self.name_directories: array = array('I')
+        self.count: int = 0
+        capacity: int = MIN_CAPACITY
+        while capacity * MAX_LOAD < expected:
+            capacity <<= 1
+        self.allocate(capacity)
+
+    def allocate(self, capacity: int) -> None:
+        '''
+        Creates empty hash table with given (power of 2) capacity
+        '''
+        self.capacity: int = capacity
+        self.hashes: array = array('Q', bytes(8 * capacity))
+        self.hash_directories: array = array('I', bytes(4 * capacity))
+        # Index of the name with keep_names, 32-bit hash of the name otherwise
+        self.hash_names: array = array('I', bytes(4 * capacity))
+
+    def name_check(self, name: str) -> int:
+        '''
+        Returns value verifying name in hash_names (the name is stored with keep_names)
+        '''
+        return len(self.names) if self.keep_names else (hash(name) >> 32) & MASK_32
+
+    def find_slot(self, key: int, directory_id: int, name: str) -> tuple:
+        '''
+        Linear probing, returns (slot, found)
+        '''
+        mask: int = self.capacity - 1
+        slot: int = key & mask
+        hashes: array = self.hashes
+        check: int = -1 if self.keep_names else self.name_check(name)
+        while True:
+            stored: int = hashes[slot]
+            if stored == 0:
+                return (slot, False)
+            if stored == key and self.hash_directories[slot] == directory_id \
+                and (self.names[self.hash_names[slot]] == name if self.keep_names \
+                else self.hash_names[slot] == check):
+                return (slot, True)
+            slot = (slot + 1) & mask
+
+    def grow(self) -> None:
+        '''
+        Doubles the hash table
+        '''
+        old_hashes: array = self.hashes
+        old_directories: array = self.hash_directories
+        old_names: array = self.hash_names
+        self.allocate(self.capacity << 1)
+        mask: int = self.capacity - 1
+        for key, directory_id, name_check in zip(old_hashes, old_directories, old_names):
+            if key:
+                # Stored paths are unique, only a free slot is needed
+                slot: int = key & mask
+                while self.hashes[slot]:
+                    slot = (slot + 1) & mask
+                self.hashes[slot] = key
+                self.hash_directories[slot] = directory_id
+                self.hash_names[slot] = name_check
+
+    def split(self, entry_path: str, create: bool) -> tuple:
+        '''
+        Returns (64-bit key, directory id, basename),
+        directory id is -1 for unknown directory when not create
+        '''
+        directory, _, name = entry_path.rpartition('/')
+        directory_id: int = self.directory_index.get(directory, -1)
+        if directory_id < 0 and create:
+            directory_id = len(self.directories)
+            self.directory_index[directory] = directory_id
+            self.directories.append(directory)
+        return ((hash(entry_path) & MASK_64) or 1, directory_id, name)
+
+    def add(self, entry_path: str) -> bool:
+        '''
+        Adds path, returns False when it was already present
+        '''
+        key, directory_id, name = self.split(entry_path, True)
+        slot, found = self.find_slot(key, directory_id, name)
+        if found:
+            return False
+        self.hashes[slot] = key
+        self.hash_directories[slot] = directory_id
+        self.hash_names[slot] = self.name_check(name)
+        self.count += 1
+        if self.keep_names:
+            self.names.append(name)
+            self.name_directories.append(directory_id)
+        if self.count > self.capacity * MAX_LOAD:
+            self.grow()
+        return True
+
+    def update(self, entry_paths: Iterable) -> None:
+        '''
+        Adds all paths from iterable
+        '''
+        for entry_path in entry_paths:
+            self.add(entry_path)
+
+    def __contains__(self, entry_path: str) -> bool:
+        key, directory_id, name = self.split(entry_path, False)
+        if directory_id < 0:
+            return False
+        return self.find_slot(key, directory_id, name)[1]
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self) -> Generator:
+        if not self.keep_names:
+            raise TypeError('PathStore created without keep_names is not iterable')
+        for directory_id, name in zip(self.name_directories, self.names):
+            yield f'{self.directories[directory_id]}/{name}'
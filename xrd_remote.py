@@ -0,0 +1,311 @@
+#!/usr/bin/python3
+# vim: set fileencoding=utf-8 :
+# Version 1.0.0
+'''
+Persistent helper process for file operations on the destination server.
+The local side starts this very module on the other end of an ssh connection
+(or locally) and sends it one JSON request per line (mkdir, link, chown, remove, load, space),
+every request is answered by one JSON line, so each operation costs
+a round trip instead of a new ssh session and remote shell.
+Other output (e.g. printed by the remote shell) is skipped.
+'''
+from base64 import b64encode
+from concurrent.futures import ThreadPoolExecutor
+from grp import getgrnam
+from json import dumps, loads
+from os import cpu_count, getloadavg, getpid, lchown, makedirs, path, readlink, rename, statvfs, \
+    statvfs_result, symlink, unlink
+from pwd import getpwnam
+from shlex import quote
+from subprocess import Popen, PIPE
+from sys import stdin, stdout
+from tempfile import TemporaryFile
+from typing import BinaryIO, Union
+from zlib import compress
+
+PYTHON: str = '/usr/bin/python3'
+# The helper runs from the source passed by bootstrap(), without __file__
+MODULE_FILE: str = path.abspath(globals().get('__file__', ''))
+REMOVE_THREADS: int = cpu_count()*2
+# Characters of the helper stderr reported when it exits
+ERROR_TAIL: int = 1_000
+
+
+def owner_ids(owner_and_group: str,
+    cache: dict = {}) -> tuple:  # pylint: disable=dangerous-default-value
+    '''
+    Translates "user:group" to (uid, gid)
+    '''
+    if owner_and_group not in cache:
+        owner, group = owner_and_group.split(':', 1)
+        cache[owner_and_group] = (getpwnam(owner).pw_uid, getgrnam(group).gr_gid)
+    return cache[owner_and_group]
+
+
+def change_owner(paths: list, owner_and_group: str) -> list:
+    '''
+    chown -h for all paths, returns paths which failed
+    '''
+    failed: list = []
+    if not owner_and_group:
+        return failed
+    uid, gid = owner_ids(owner_and_group)
+    for owned_path in paths:
+        try:
+            lchown(owned_path, uid, gid)
+        except OSError:
+            failed.append(owned_path)
+    return failed
+
+
+def make_directories(request: dict) -> list:
+    '''
+    mkdir -p for all paths, then chown of request['chown'] paths
+    '''
+    failed: list = []
+    for directory in request['paths']:
+        try:
+            makedirs(directory, exist_ok=True)
+        except OSError:
+            failed.append(directory)
+    return failed + change_owner(request.get('chown', []), request.get('owner', ''))
+
+
+def make_links(request: dict) -> list:
+    '''
+    ln -sf target link (atomically) for all [target, link] pairs in request['links'],
+    then chown -h of created links and request['chown'] paths
+    '''
+    failed: list = []
+    created: list = []
+    for target, link in request['links']:
+        temporary_link: str = f'{link}.xrd-remote-{getpid()}'
+        try:
+            symlink(target, temporary_link)
+            rename(temporary_link, link)
+            created.append(link)
+        except OSError:
+            failed.append(link)
+            try:
+                unlink(temporary_link)
+            except OSError:
+                pass
+    return failed + change_owner(created + request.get('chown', []), request.get('owner', ''))
+
+
+def remove_entry(link: str) -> tuple:
+    '''
+    rm -f "$(readlink link)" link, returns (link removed, data file removed)
+    '''
+    try:
+        target: str = readlink(link)
+    except FileNotFoundError:
+        return (False, False)
+    except OSError:
+        # Not a link, remove the entry only
+        target = ''
+    file_removed: bool = False
+    if target:
+        try:
+            unlink(path.join(path.dirname(link), target))
+            file_removed = True
+        except FileNotFoundError:
+            pass
+    unlink(link)
+    return (True, file_removed)
+
+
+def remove_entries(request: dict) -> dict:
+    '''
+    Removes all request['links'] and their targets in parallel
+    '''
+    failed: list = []
+    removed: int = 0
+    files: int = 0
+
+    def remove_one(link: str) -> Union[tuple, None]:
+        try:
+            return remove_entry(link)
+        except OSError:
+            return None
+
+    with ThreadPoolExecutor(REMOVE_THREADS) as removers:
+        for link, result in zip(request['links'], removers.map(remove_one, request['links'])):
+            if result is None:
+                failed.append(link)
+            else:
+                removed += result[0]
+                files += result[1]
+    return {'ok': not failed, 'failed': failed, 'removed': removed, 'files': files}
+
+
+def free_space(space_path: str) -> int:
+    '''
+    Bytes available to unprivileged users on filesystem of space_path
+    '''
+    filesystem: statvfs_result = statvfs(space_path)
+    return filesystem.f_bavail * filesystem.f_frsize
+
+
+OPERATIONS: dict = {
+    'mkdir': make_directories,
+    'link': make_links,
+    'chown': lambda request: change_owner(request['paths'], request['owner']),
+    'remove': remove_entries,
+    'load': lambda request: {'ok': True, 'failed': [], 'load': getloadavg()[0] / cpu_count()},
+    'space': lambda request: {'ok': True, 'failed': [], 'space': free_space(request['path'])},
+}
+
+
+def handle(request: dict) -> dict:
+    '''
+    Runs one request, returns its response
+    '''
+    try:
+        result: Union[list, dict] = OPERATIONS[request['op']](request)
+    except Exception as exception:  # pylint: disable=broad-except
+        return {'ok': False, 'failed': [], 'error': repr(exception)}
+    # Operations return failed paths or complete response
+    if isinstance(result, dict):
+        return result
+    return {'ok': not result, 'failed': result}
+
+
+def serve() -> None:
+    '''
+    Helper side, answers requests from stdin until "exit" or EOF
+    '''
+    for line in stdin:
+        request: dict = loads(line)
+        if request['op'] == 'exit':
+            break
+        stdout.write(f'{dumps(handle(request))}\n')
+        stdout.flush()
+
+
+def bootstrap() -> str:
+    '''
+    Python one-liner starting the helper from compressed source of this module
+    '''
+    with open(MODULE_FILE, 'rb') as source:
+        packed: str = b64encode(compress(source.read(), 9)).decode('ascii')
+    return f"import base64,zlib;exec(zlib.decompress(base64.b64decode('{packed}')))"
+
+
+class RemoteHelper:
+    '''
+    Local side of the helper, ssh_command is the ssh command line
+    including the server (empty list runs the helper locally)
+    '''
+    def __init__(self, ssh_command: list) -> None:
+        self.ssh_command: list = ssh_command
+        self.process: Union[Popen, None] = None
+        # stderr of the helper (and of ssh), read when the helper exits
+        self.errors: Union[BinaryIO, None] = None
+
+    def start(self) -> None:
+        '''
+        Starts the helper process
+        '''
+        helper: list = [PYTHON, '-u', '-c', bootstrap()]
+        if self.ssh_command:
+            helper = self.ssh_command + [' '.join(quote(argument) for argument in helper)]
+        self.errors = TemporaryFile()  # pylint: disable=consider-using-with
+        self.process = Popen(  # pylint: disable=consider-using-with
+            helper, stdin=PIPE, stdout=PIPE, stderr=self.errors, \
+            encoding='utf-8', errors='replace')
+
+    def read_reply(self) -> dict:
+        '''
+        Returns the next answer of the helper, skipping lines which are not
+        JSON objects, raises RuntimeError with the helper stderr when it exits
+        '''
+        skipped: list = []
+        for line in iter(self.process.stdout.readline, ''):
+            try:
+                reply: object = loads(line)
+            except ValueError:
+                reply = None
+            if isinstance(reply, dict):
+                return reply
+            skipped.append(line.strip())
+        self.process.wait()
+        self.errors.seek(0)
+        errors: str = ' '.join(self.errors.read().decode('utf-8', 'replace').split())[-ERROR_TAIL:]
+        raise RuntimeError(f'Helper exited with {self.process.returncode}' \
+            + (f', stderr: {errors}' if errors else '') \
+            + (f', skipped output: {" ".join(skipped)[-ERROR_TAIL:]}' if skipped else ''))
+
+    def request(self, operation: str, **arguments) -> dict:
+        '''
+        Sends one request and waits for the answer,
+        a dead helper (e.g. dropped ssh) is restarted on the next request
+        '''
+        if self.process is None or self.process.poll() is not None:
+            self.start()
+        try:
+            self.process.stdin.write(f"{dumps({'op': operation, **arguments})}\n")
+            self.process.stdin.flush()
+        except OSError:
+            # The helper exited already, read_reply() tells why
+            pass
+        try:
+            return self.read_reply()
+        except OSError as exception:
+            error: str = repr(exception)
+        except RuntimeError as exception:
+            error = str(exception)
+        self.close()
+        return {'ok': False, 'failed': [], 'error': error}
+
+    def close(self) -> None:
+        '''
+        Stops the helper process
+        '''
+        if self.process is None:
+            return
+        try:
+            if self.process.poll() is None:
+                self.process.stdin.write(f"{dumps({'op': 'exit'})}\n")
+                self.process.stdin.close()
+        except OSError:
+            pass
+        self.process.wait()
+        self.process = None
+        self.errors.close()
+        self.errors = None
+
+
+def check_helper(ssh_command: list, space_path: str = '/') -> str:
+    '''
+    Starts the bootstrapped helper (like RemoteHelper does) and sends it one request,
+    returns the error or '' when the helper works
+    '''
+    helper: RemoteHelper = RemoteHelper(ssh_command)
+    try:
+        response: dict = helper.request('space', path=space_path)
+    finally:
+        helper.close()
+    if 'error' in response:
+        return response['error']
+    return ''
+
+
+class LocalHelper:
+    '''
+    Same interface as RemoteHelper, runs the operations in the calling process
+    '''
+    def request(self, operation: str, **arguments) -> dict:
+        '''
+        Runs one request
+        '''
+        return handle({'op': operation, **arguments})
+
+    def close(self) -> None:
+        '''
+        Nothing to stop
+        '''
+
+
+if __name__ == '__main__':
+    serve()
@@ -0,0 +1,387 @@
+#!/usr/bin/python3
+# vim: set fileencoding=utf-8 :
+# Version 1.0.0
+'''
+Shared multi-threaded directory scanner used by all xrdtools scripts.
+Every worker owns a deque of directories to scan and steals work
+from the other workers when its own deque runs dry.
+Results are handed to the consumer in batches of Entry records
+through a bounded queue, workers pause when the consumer falls behind.
+Optionally the tree is split into subtrees scanned by a pool of processes,
+which stream the results back as compact per-directory records.
+With an index (xrd_index.ScanIndex) unchanged directories are not listed again.
+With resolve_links the workers also read and check the link targets,
+so consumers do not need a second pass over all links.
+'''
+from collections import deque
+from multiprocessing import Pool
+from multiprocessing import Queue as mpQueue
+from os import cpu_count, path, readlink, scandir, stat
+from queue import Queue, Full
+from sys import stderr
+from threading import Condition, Thread
+from time import monotonic
+from typing import Generator, Iterator, NamedTuple, Union
+from xrd_index import ScanIndex
+
+THREADS: int = cpu_count()*2
+BATCH_SIZE: int = 1_000
+HIGH_WATER: int = 100_000
+IDLE_WAIT: float = 0.01
+SPLIT_FACTOR: int = 8
+SPLIT_DEPTH: int = 4
+MODULE_FILE: str = path.abspath(__file__)
+SUBTREE_QUEUE: Union[mpQueue, None] = None
+
+FILE: int = 0
+LINK: int = 1
+DIRECTORY: int = 2
+
+
+class Entry(NamedTuple):
+    '''
+    Single entry found by scan()
+    '''
+    directory: str
+    name: str
+    kind: int
+    # Absolute link target (scans with index or resolve_links), '' when unreadable,
+    # with resolve_links also '' when the target is not an existing file
+    target: Union[str, None] = None
+
+    @property
+    def path(self) -> str:
+        '''
+        Full path of the entry (same as os.DirEntry.path)
+        '''
+        return path.join(self.directory, self.name)
+
+
+def link_target(link: str) -> str:
+    '''
+    Absolute target of link, '' when it can not be read
+    '''
+    try:
+        target: str = readlink(link)
+    except OSError:
+        return ''
+    if not path.isabs(target):
+        target = path.abspath(path.join(path.dirname(link), target))
+    return target
+
+
+def file_target(target: str) -> str:
+    '''
+    Returns target when it is an existing file, '' otherwise
+    '''
+    if target and path.isfile(target):
+        return target
+    return ''
+
+
+def list_directory(directory: str, index: ScanIndex) -> list:
+    '''
+    Lists directory as [(name, kind, target), ...],
+    from index when the directory did not change since it was stored
+    '''
+    mtime: int = stat(directory).st_mtime_ns
+    listing: Union[list, None] = index.lookup(directory, mtime)
+    if listing is None:
+        listing = []
+        with scandir(directory) as items:
+            for item in items:
+                if item.is_symlink():
+                    listing.append((item.name, LINK, link_target(item.path)))
+                elif item.is_file():
+                    listing.append((item.name, FILE, None))
+                else:
+                    listing.append((item.name, DIRECTORY, None))
+        index.store(directory, mtime, listing)
+    return listing
+
+
+def scan_directory(directory: str, resolve_links: bool = False) -> tuple:
+    '''
+    Lists one directory as compact record (directory, NUL joined names, kinds,
+    NUL joined link targets or None) and returns it together with its subdirectories
+    '''
+    names: list = []
+    kinds: bytearray = bytearray()
+    targets: list = []
+    subdirectories: list = []
+    try:
+        with scandir(directory) as items:
+            for item in items:
+                names.append(item.name)
+                if item.is_symlink():
+                    kinds.append(LINK)
+                    if resolve_links:
+                        targets.append(file_target(link_target(item.path)))
+                elif item.is_file():
+                    kinds.append(FILE)
+                else:
+                    kinds.append(DIRECTORY)
+                    subdirectories.append(item.path)
+    except OSError as exception:
+        print(exception, file=stderr)
+    joined_targets: Union[str, None] = '\x00'.join(targets) if resolve_links else None
+    return ((directory, '\x00'.join(names), bytes(kinds), joined_targets), subdirectories)
+
+
+def unpack_record(record: tuple) -> Generator:
+    '''
+    Yields Entry for every name in record made by scan_directory(),
+    raises ValueError when the record has fewer link targets than links
+    '''
+    directory, names, kinds, targets = record
+    if not kinds:
+        return
+    if targets is not None and LINK in kinds:
+        links: Iterator = iter(targets.split('\x00'))
+        for name, kind in zip(names.split('\x00'), kinds):
+            if kind == LINK:
+                target: Union[str, None] = next(links, None)
+                if target is None:
+                    raise ValueError(f'Record of {directory} has no link target of {name}')
+                yield Entry(directory, name, kind, target)
+            else:
+                yield Entry(directory, name, kind)
+    else:
+        for name, kind in zip(names.split('\x00'), kinds):
+            yield Entry(directory, name, kind)
+
+
+def subtree_worker_init(subtree_queue: mpQueue) -> None:
+    '''
+    Pool initializer, queues can only be passed by inheritance
+    '''
+    global SUBTREE_QUEUE  # pylint: disable=global-statement
+    SUBTREE_QUEUE = subtree_queue
+
+
+def scan_subtree(subtree: str,
+    batch_size: int = BATCH_SIZE,
+    resolve_links: bool = False) -> None:
+    '''
+    Scans whole subtree in pool process and streams
+    batches of directory records to SUBTREE_QUEUE
+    '''
+    subtree_stalls: int = 0
+    subtree_stall_time: float = 0.0
+    try:
+        batch: list = []
+        batch_entries: int = 0
+        directories: list = [subtree]
+        while directories:
+            record, subdirectories = scan_directory(directories.pop(), resolve_links)
+            directories.extend(subdirectories)
+            batch.append(record)
+            batch_entries += len(record[2])
+            if batch_entries >= batch_size:
+                if SUBTREE_QUEUE.full():
+                    subtree_stalls += 1
+                    stall_start: float = monotonic()
+                    SUBTREE_QUEUE.put(batch)
+                    subtree_stall_time += monotonic() - stall_start
+                else:
+                    SUBTREE_QUEUE.put(batch)
+                batch = []
+                batch_entries = 0
+        if batch:
+            SUBTREE_QUEUE.put(batch)
+    finally:
+        # Tuple marks the end of the subtree, lists are batches
+        SUBTREE_QUEUE.put((subtree_stalls, subtree_stall_time))
+
+
+def scan_processes(top: str,
+    processes: int,
+    batch_size: int = BATCH_SIZE,
+    high_water: int = HIGH_WATER,
+    stats: Union[dict, None] = None,
+    resolve_links: bool = False) -> Generator:
+    '''
+    Multi-process version of scan(), top levels are listed here
+    until there are enough subtrees to keep the pool busy
+    '''
+    if not path.isdir(top):
+        return
+    frontier: list = [top]
+    depth: int = 0
+    while frontier and len(frontier) < processes * SPLIT_FACTOR and depth < SPLIT_DEPTH:
+        next_frontier: list = []
+        for directory in frontier:
+            record, subdirectories = scan_directory(directory, resolve_links)
+            next_frontier.extend(subdirectories)
+            yield from unpack_record(record)
+        frontier = next_frontier
+        depth += 1
+    if not frontier:
+        return
+    subtree_queue: mpQueue = mpQueue(max(high_water // max(batch_size, 1), 1))
+    pool: Pool = Pool(processes, initializer=subtree_worker_init, \
+        initargs=(subtree_queue,))  # pylint: disable=consider-using-with
+    stalls: int = 0
+    stall_time: float = 0.0
+    try:
+        pool.starmap_async(scan_subtree, \
+            [(subtree, batch_size, resolve_links) for subtree in frontier], chunksize=1)
+        running: int = len(frontier)
+        while running:
+            subtree_batch: Union[list, tuple] = subtree_queue.get()
+            if isinstance(subtree_batch, tuple):
+                stalls += subtree_batch[0]
+                stall_time += subtree_batch[1]
+                running -= 1
+            else:
+                for record in subtree_batch:
+                    yield from unpack_record(record)
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+        if stats is not None:
+            stats['stalls'] = stats.get('stalls', 0) + stalls
+            stats['stall_time'] = stats.get('stall_time', 0.0) + stall_time
+
+
+def scan(top: str,   # pylint: disable=too-many-locals
+    threads: int = THREADS,
+    batch_size: int = BATCH_SIZE,
+    high_water: int = HIGH_WATER,
+    stats: Union[dict, None] = None,
+    processes: int = 0,
+    index: Union[ScanIndex, None] = None,
+    resolve_links: bool = False) -> Generator:
+    '''
+    Multi-threaded replacement of os.walk(),
+    yields Entry for every file, link and directory below top.
+    At most high_water entries wait for the consumer,
+    stats (if given) receive how often and how long the workers were paused.
+    With processes > 0 the scan is done by scan_processes() instead,
+    index (xrd_index.ScanIndex) is supported by the threaded scan only.
+    resolve_links fills Entry.target of links pointing to existing files.
+    '''
+    if processes > 0 and index is None:
+        yield from scan_processes(top, processes, batch_size, high_water, stats, resolve_links)
+        return
+    if not path.isdir(top):
+        return
+    threads = max(threads, 1)
+    queues: list = [deque() for _ in range(threads)]
+    queues[0].append(top)
+    # Each slot is written only by its own worker, no lock needed
+    added: list = [0] * threads
+    finished: list = [0] * threads
+    stalls: list = [0] * threads
+    stall_time: list = [0.0] * threads
+    on_idle: Condition = Condition()
+    state: dict = {'idle': 0, 'stop': False}
+    output: Queue = Queue(max(high_water // max(batch_size, 1), 1))
+
+    def pending() -> bool:
+        # finished must be summed before added, both only grow
+        finished_count: int = sum(finished)
+        return finished_count != sum(added) + 1
+
+    def steal(thief: int) -> Union[str, None]:
+        for victim in range(thief + 1, thief + threads):
+            try:
+                return queues[victim % threads].popleft()
+            except IndexError:
+                continue
+        return None
+
+    def hand_over(worker_id: int, batch: Union[list, None]) -> None:
+        try:
+            output.put_nowait(batch)
+            return
+        except Full:
+            stalls[worker_id] += 1
+        # Consumer is behind, pause until it catches up (or gives up)
+        stall_start: float = monotonic()
+        while not state['stop']:
+            try:
+                output.put(batch, timeout=IDLE_WAIT)
+                break
+            except Full:
+                continue
+        stall_time[worker_id] += monotonic() - stall_start
+
+    def worker(worker_id: int) -> None:
+        own: deque = queues[worker_id]
+        batch: list = []
+        while not state['stop']:
+            try:
+                fs_path: Union[str, None] = own.pop()
+            except IndexError:
+                fs_path = steal(worker_id)
+            if fs_path is None:
+                if batch:
+                    hand_over(worker_id, batch)
+                    batch = []
+                if not pending():
+                    with on_idle:
+                        on_idle.notify_all()
+                    break
+                with on_idle:
+                    state['idle'] += 1
+                    on_idle.wait(IDLE_WAIT)
+                    state['idle'] -= 1
+                continue
+            try:
+                if index is None:
+                    with scandir(fs_path) as items:
+                        for item in items:
+                            target: Union[str, None] = None
+                            if item.is_symlink():
+                                kind: int = LINK
+                                if resolve_links:
+                                    target = file_target(link_target(item.path))
+                            elif item.is_file():
+                                kind = FILE
+                            else:
+                                kind = DIRECTORY
+                                added[worker_id] += 1
+                                own.append(item.path)
+                            batch.append(Entry(fs_path, item.name, kind, target))
+                else:
+                    for name, kind, target in list_directory(fs_path, index):
+                        if kind == DIRECTORY:
+                            added[worker_id] += 1
+                            own.append(path.join(fs_path, name))
+                        elif kind == LINK and resolve_links:
+                            target = file_target(target)
+                        batch.append(Entry(fs_path, name, kind, target))
+            except OSError as exception:
+                print(exception, file=stderr)
+            finished[worker_id] += 1
+            if len(batch) >= batch_size:
+                hand_over(worker_id, batch)
+                batch = []
+            if state['idle'] and len(own) > 1:
+                with on_idle:
+                    on_idle.notify()
+        hand_over(worker_id, None)
+
+    workers: list = [Thread(target=worker, args=(i,), name=f'fastio.walk {i} {top}') \
+        for i in range(threads)]
+    for start_worker in workers:
+        start_worker.start()
+    try:
+        running: int = threads
+        while running:
+            walk_batch: Union[list, None] = output.get()
+            if walk_batch is None:
+                running -= 1
+            else:
+                yield from walk_batch
+        if index is not None:
+            index.finish(top)
+    finally:
+        state['stop'] = True
+        with on_idle:
+            on_idle.notify_all()
+        if stats is not None:
+            stats['stalls'] = stats.get('stalls', 0) + sum(stalls)
+            stats['stall_time'] = stats.get('stall_time', 0.0) + sum(stall_time)
@@ -0,0 +1,101 @@
+#!/usr/bin/python3
+# vim: set fileencoding=utf-8 :
+# Version 1.0.0
+'''
+Compact wire format of path listings sent from the remote servers.
+Every path is front-coded against the previous one
+(bytes shared with it, length of the rest, the rest) and the records
+are compressed by one zlib stream, so the long common prefixes of the name space
+cost almost nothing. Paths listed directory by directory share the most.
+Both sides work incrementally on chunks.
+remote_entries() streams the listing (compressed or NUL separated) of a remote command.
+'''
+from functools import partial
+from io import TextIOWrapper
+from os import path
+from struct import calcsize, pack, unpack_from
+from subprocess import Popen, PIPE
+from sys import stderr
+from typing import Generator, Iterable
+from zlib import compressobj, decompressobj, error as ZlibError
+from xrd_extsort import read_records, CHUNK_SIZE, ENCODING
+
+# Shared prefix length, suffix length (paths are shorter than 64 KiB)
+HEADER: str = '<HH'
+HEADER_SIZE: int = calcsize(HEADER)
+BLOCK_SIZE: int = 1 << 16
+COMPRESSION_LEVEL: int = 6
+MODULE_FILE: str = path.abspath(__file__)
+
+
+def encode_paths(paths: Iterable,
+    level: int = COMPRESSION_LEVEL,
+    block_size: int = BLOCK_SIZE) -> Generator:
+    '''
+    Yields compressed chunks of front-coded paths
+    '''
+    compressor: object = compressobj(level)
+    previous: bytes = b''
+    block: bytearray = bytearray()
+    for path_string in paths:
+        encoded: bytes = path_string.encode('utf-8', 'surrogateescape')
+        shared: int = len(path.commonprefix([previous, encoded]))
+        block += pack(HEADER, shared, len(encoded) - shared)
+        block += encoded[shared:]
+        previous = encoded
+        if len(block) >= block_size:
+            compressed: bytes = compressor.compress(block)
+            block.clear()
+            if compressed:
+                yield compressed
+    yield compressor.compress(block) + compressor.flush()
+
+
+def decode_paths(chunks: Iterable) -> Generator:
+    '''
+    Yields paths from compressed chunks made by encode_paths(),
+    raises ValueError when the listing is corrupted or truncated
+    '''
+    decompressor: object = decompressobj()
+    pending: bytes = b''
+    previous: bytes = b''
+
+    def records(data: bytes) -> Generator:
+        nonlocal pending, previous
+        pending += data
+        position: int = 0
+        while position + HEADER_SIZE <= len(pending):
+            shared, suffix = unpack_from(HEADER, pending, position)
+            end: int = position + HEADER_SIZE + suffix
+            if end > len(pending):
+                break
+            previous = previous[:shared] + pending[position + HEADER_SIZE:end]
+            yield previous.decode('utf-8', 'surrogateescape')
+            position = end
+        pending = pending[position:]
+
+    try:
+        for chunk in chunks:
+            yield from records(decompressor.decompress(chunk))
+        yield from records(decompressor.flush())
+    except ZlibError as exception:
+        raise ValueError(f'Corrupted path listing: {exception}') from exception
+    if pending or not decompressor.eof:
+        raise ValueError('Truncated path listing')
+
+
+def remote_entries(command: list, compressed: bool = False) -> Generator:
+    '''
+    Runs command and yields its NUL separated (or encode_paths() compressed) output entries
+    as they arrive, read in fixed size chunks, so the listing is never held in memory as a whole
+    '''
+    with Popen(command, stdout=PIPE, stderr=stderr) as process:
+        if compressed:
+            try:
+                yield from decode_paths(iter(partial(process.stdout.read, CHUNK_SIZE), b''))
+            except ValueError as exception:
+                print(f'{" ".join(command)}: {exception}', file=stderr)
+        else:
+            yield from read_records(TextIOWrapper(process.stdout, **ENCODING))
+    if process.returncode:
+        print(f'{" ".join(command)} failed with {process.returncode}', file=stderr)